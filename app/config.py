@@ -16,6 +16,7 @@ class Settings(BaseSettings):
 
     # Указываем точное имя переменной окружения
     bot_token: str = Field(..., env="BOT_TOKEN")
+    telegram_api_url: str | None = Field(default=None, env="TELEGRAM_API_URL")  # custom Bot API server
     gsb_api_key: str | None = Field(default=None, env="GSB_API_KEY")
 
     environment: str = Field(default="production", env="ENVIRONMENT")
@@ -26,14 +27,91 @@ class Settings(BaseSettings):
     request_timeout: int = Field(default=30, env="REQUEST_TIMEOUT")  # 30 seconds
     rate_limit_requests: int = Field(default=10, env="RATE_LIMIT_REQUESTS")  # requests per minute
     rate_limit_window: int = Field(default=60, env="RATE_LIMIT_WINDOW")  # seconds
+    rate_limit_qr_requests: int = Field(default=5, env="RATE_LIMIT_QR_REQUESTS")  # /qr per window
+    rate_limit_url_requests: int = Field(default=20, env="RATE_LIMIT_URL_REQUESTS")  # link checks per window
+    rate_limit_eviction_interval: int = Field(default=300, env="RATE_LIMIT_EVICTION_INTERVAL")  # seconds
+
+    gsb_api_url: str = Field(default="https://safebrowsing.googleapis.com/v4", env="GSB_API_URL")
+    gsb_batch_window_ms: int = Field(default=50, env="GSB_BATCH_WINDOW_MS")  # wait to coalesce lookups
+    gsb_batch_max_size: int = Field(default=500, env="GSB_BATCH_MAX_SIZE")  # API limit is 500 entries
+    gsb_local_lists: bool = Field(default=False, env="GSB_LOCAL_LISTS")  # local hash-prefix database
+    gsb_update_interval: int = Field(default=1800, env="GSB_UPDATE_INTERVAL")  # seconds between list syncs
+
+    url_cache_ttl_safe: int = Field(default=3600, env="URL_CACHE_TTL_SAFE")  # seconds
+    url_cache_ttl_unsafe: int = Field(default=6 * 3600, env="URL_CACHE_TTL_UNSAFE")  # seconds
+    url_cache_max_items: int = Field(default=10_000, env="URL_CACHE_MAX_ITEMS")
+    url_cache_max_bytes: int = Field(default=16 * 1024 * 1024, env="URL_CACHE_MAX_BYTES")  # approx. memory cap
+    url_cache_db_path: str | None = Field(default=None, env="URL_CACHE_DB_PATH")  # SQLite file, off by default
+    url_cache_flush_interval: float = Field(default=30.0, env="URL_CACHE_FLUSH_INTERVAL")  # seconds
+
+    redirect_max_hops: int = Field(default=10, env="REDIRECT_MAX_HOPS")
+    redirect_deadline: float = Field(default=8.0, env="REDIRECT_DEADLINE")  # seconds for the whole chain
+    redirect_hop_timeout: float = Field(default=4.0, env="REDIRECT_HOP_TIMEOUT")  # seconds per request
+
+    admission_max_pending: int = Field(default=100, env="ADMISSION_MAX_PENDING")  # photos in pipeline before shedding
+    admission_downloads: int = Field(default=8, env="ADMISSION_DOWNLOADS")  # concurrent downloads
+    admission_decodes: int = Field(default=4, env="ADMISSION_DECODES")  # concurrent decode jobs
+    admission_url_checks: int = Field(default=16, env="ADMISSION_URL_CHECKS")  # concurrent link checks
+
+    qr_render_cache_size: int = Field(default=512, env="QR_RENDER_CACHE_SIZE")  # rendered /qr PNGs
+    qr_render_cache_bytes: int = Field(default=32 * 1024 * 1024, env="QR_RENDER_CACHE_BYTES")
+    qr_file_id_cache_size: int = Field(default=10_000, env="QR_FILE_ID_CACHE_SIZE")  # sent /qr photos
+    inline_upload_chat_id: int | None = Field(default=None, env="INLINE_UPLOAD_CHAT_ID")  # enables inline mode
+    inline_debounce: float = Field(default=0.4, env="INLINE_DEBOUNCE")  # seconds without new keystrokes
+    inline_cache_time: int = Field(default=3600, env="INLINE_CACHE_TIME")  # Telegram-side result cache, seconds
+
+    slow_update_threshold: float = Field(default=2.0, env="SLOW_UPDATE_THRESHOLD")  # seconds, logged with stages
+
+    stats_file_path: str = Field(default="stats.txt", env="STATS_FILE_PATH")
+    stats_flush_interval: float = Field(default=60.0, env="STATS_FLUSH_INTERVAL")  # seconds
+
+    state_backend: str = Field(default="memory", env="STATE_BACKEND")  # memory | sqlite (shared by workers)
+    state_db_path: str = Field(default="state.db", env="STATE_DB_PATH")  # SQLite file for STATE_BACKEND=sqlite
+    workers: int = Field(default=1, env="WORKERS")  # bot processes (webhook mode), each with its own decode pool; albums and /metrics are per worker
+
+    http_pool_size: int = Field(default=100, env="HTTP_POOL_SIZE")  # connections in total
+    http_pool_per_host: int = Field(default=10, env="HTTP_POOL_PER_HOST")  # connections per host
+    http_dns_cache_ttl: int = Field(default=300, env="HTTP_DNS_CACHE_TTL")  # seconds
+    http_keepalive_timeout: float = Field(default=30.0, env="HTTP_KEEPALIVE_TIMEOUT")  # seconds
+
+    webhook_base_url: str | None = Field(default=None, env="BASE_WEBHOOK_URL")  # enables webhook mode
+    webhook_path: str = Field(default="/webhook", env="WEBHOOK_PATH")
+    webhook_secret: str | None = Field(default=None, env="WEBHOOK_SECRET")  # X-Telegram-Bot-Api-Secret-Token
+    webhook_max_concurrency: int = Field(default=32, env="WEBHOOK_MAX_CONCURRENCY")  # updates processed at once
+    webhook_queue_size: int = Field(default=1000, env="WEBHOOK_QUEUE_SIZE")  # accepted, not yet processed
+
+    decode_workers: int = Field(default=2, env="DECODE_WORKERS")  # processes in the decode pool
+    decode_queue_size: int = Field(default=32, env="DECODE_QUEUE_SIZE")  # jobs queued + running
+    decode_timeout: float = Field(default=10.0, env="DECODE_TIMEOUT")  # seconds per image
+    photo_min_side: int = Field(default=320, env="PHOTO_MIN_SIDE")  # px, smallest photo size tried first
+    decode_downscale_side: int = Field(default=800, env="DECODE_DOWNSCALE_SIDE")  # px, first cheap pass
+    decode_draft_side: int = Field(default=1600, env="DECODE_DRAFT_SIDE")  # px, big JPEGs are decoded reduced
+    decode_max_pixels: int = Field(default=25_000_000, env="DECODE_MAX_PIXELS")  # larger images (after JPEG draft) are rejected
+    decode_roi_regions: int = Field(default=3, env="DECODE_ROI_REGIONS")  # candidate crops, 0 disables
+    decode_cpu_budget: float = Field(default=2.0, env="DECODE_CPU_BUDGET")  # CPU seconds per image
+    media_group_window: float = Field(default=0.5, env="MEDIA_GROUP_WINDOW")  # seconds to collect an album
+    decode_max_codes: int = Field(default=5, env="DECODE_MAX_CODES")  # QR codes answered per photo
+    decode_cache_size: int = Field(default=5000, env="DECODE_CACHE_SIZE")  # entries per key type
+    decode_cache_ttl: int = Field(default=24 * 3600, env="DECODE_CACHE_TTL")  # seconds
 
     @property
     def is_debug(self) -> bool:
         return self.environment.lower() == "development"
 
+    @property
+    def use_webhook(self) -> bool:
+        return bool(self.webhook_base_url)
+
+    @property
+    def webhook_url(self) -> str:
+        return self.webhook_base_url.rstrip("/") + self.webhook_path
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # Устанавливаем debug_mode на основе environment
         self.debug_mode = self.is_debug
+        # Без секрета вебхук принял бы любой POST как апдейт от Telegram
+        if self.use_webhook and not self.webhook_secret:
+            raise ValueError("WEBHOOK_SECRET is required when WEBHOOK_BASE_URL is set")
 
 # settings = Settings() # <-- УБРАНО! Экземпляр будет создан в main.py
@@ -3,24 +3,45 @@ import html
 import logging
 import aiohttp
 import asyncio
-from functools import partial
-from datetime import date
 from urllib.parse import urlparse
-from io import BytesIO
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Document, Message, InlineKeyboardMarkup, InlineKeyboardButton, PhotoSize, Update
 from aiogram.filters import Command
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, BufferedInputFile
+from aiogram.types import InlineQuery, InlineQueryResultCachedPhoto, InlineQueryResultsButton
 from aiogram.utils.markdown import hbold, hcode
-from app.services.qr_decoder import decode_qr_locally
-from app.services.security import is_rate_limited, check_url_safety
+from app.services.decode_engine import DecodeEngine, DecodeFailed, DecodeQueueFull
+from app.services.decode_cache import DecodeCache, content_hash
+from app.services.security import (
+    is_rate_limited, rate_limiter, check_url_safety, safety_flight,
+    setup_url_cache, close_url_cache, start_threat_lists, stop_threat_lists,
+)
 from aiogram.types import BufferedInputFile
-from app.services.generator import generate_qr_code
+from app.services.generator import configure_render_cache, render_qr_png
+from app.services.redirects import resolve_redirect_chain
+from app.services.metrics import (
+    CODES, DECODES, SAFE_BROWSING_REQUESTS, SAFE_BROWSING_URLS, SCANS, SINGLEFLIGHT_CALLS, THREAT_LIST_LOCAL_VERDICTS,
+    observe_stage,
+)
+from app.services.stats_store import StatsStore
+from app.services.state import create_state_backend
+from app.services.profiling import ProfilerBusy, monitor_loop_lag, profile_for
+from app.middlewares.admission import AdmissionController, AdmissionMiddleware
+from app.middlewares.album import MediaGroupMiddleware
+from app.middlewares.tracing import TracingMiddleware
+from app.utils.buffers import FileTooLarge, PreallocatedBuffer
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.urls import normalize_url
 
 logger = logging.getLogger(__name__)
 
@@ -36,11 +57,11 @@ def get_cancel_kb():
     )
 
 # === Статистика ===
-total_scans = 0
-daily_scans = 0
-last_reset = date.today()
 OWNER_ID = 7679979587
 
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
+
 # === Вспомогательная функция: Проверка на "скучный" редирект ===
 def is_trivial_redirect(original: str, final: str) -> bool:
     """
@@ -66,21 +87,28 @@ def detect_qr_type(content: str) -> str:
     if urlparse(content.strip()).scheme in ('http', 'https'): return "url"
     return "text"
 
-async def resolve_url(url: str) -> str:
-    """Проходит по редиректам и возвращает конечную ссылку."""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url, allow_redirects=True, timeout=5) as response:
-                return str(response.url)
-    except Exception:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, allow_redirects=True, timeout=5) as response:
-                    return str(response.url)
-        except Exception:
-            return url
+# Одна и та же ссылка с вирусного постера резолвится один раз, даже если её сканируют толпой
+resolve_flight = SingleFlight("resolve", SINGLEFLIGHT_CALLS)
+
+async def resolve_url(url: str, session: aiohttp.ClientSession, settings, on_hop=None) -> list[str]:
+    """
+    Проходит по редиректам и возвращает всю цепочку ссылок.
+    Цепочка могла достаться от схлопнутого вызова с той же ссылкой в другом
+    написании (регистр хоста, #фрагмент) — первой в ней ставим свою.
+    """
+    chain = await resolve_flight.do(
+        normalize_url(url), resolve_redirect_chain, url, session, settings, on_hop
+    )
+    return [url, *chain[1:]]
 
-async def format_qr_response(content: str, qr_type: str, settings):
+def worst_verdict(verdicts: list[tuple[bool | None, str | None]]) -> tuple[bool | None, str | None]:
+    """Итог по цепочке: опасна любая ссылка — опасна вся цепочка, иначе решает конечная."""
+    for verdict in verdicts:
+        if verdict[0] is False:
+            return verdict
+    return verdicts[-1]
+
+async def format_qr_response(content: str, qr_type: str, settings, http_session: aiohttp.ClientSession):
     # --- ОБРАБОТКА WI-FI ---
     if qr_type == "wifi":
         ssid = "Не указано"
@@ -106,33 +134,47 @@ async def format_qr_response(content: str, qr_type: str, settings):
 
     # --- ОБРАБОТКА ССЫЛОК ---
     elif qr_type == "url":
-        final_url = await resolve_url(content)
-        
+        # Каждую ссылку цепочки проверяем сразу, как только узнали о ней,
+        # — проверка безопасности идёт параллельно с резолвом редиректов
+        safety_tasks: dict[str, asyncio.Task] = {}
+
+        def check_hop(hop_url: str):
+            if hop_url not in safety_tasks:
+                safety_tasks[hop_url] = asyncio.create_task(check_url_safety(hop_url, settings, http_session))
+
+        check_hop(content)
+        with observe_stage("resolve_url"):
+            chain = await resolve_url(content, http_session, settings, on_hop=check_hop)
+        # Если резолв схлопнулся с чужим запросом, on_hop вызывался не для нас
+        for hop_url in chain:
+            check_hop(hop_url)
+        final_url = chain[-1]
+
         # Проверяем, изменилась ли ссылка и не является ли это просто сменой http на https
         changed = final_url != content
         trivial = is_trivial_redirect(content, final_url)
-        
+
         # Показываем предупреждение только если редирект РЕАЛЬНЫЙ
         show_redirect_warning = changed and not trivial
-        
+
         escaped_original = html.escape(content)
         escaped_final = html.escape(final_url)
-        
+
         if show_redirect_warning:
-            header = (
-                f"{hbold('🔗 Переадресация обнаружена!')}\n"
-                f"Оригинал: {escaped_original}\n"
-                f"⬇️\n"
-                f"Ведёт на: {hbold(escaped_final)}\n"
-            )
+            header = f"{hbold('🔗 Переадресация обнаружена!')}\nОригинал: {escaped_original}\n"
+            # Промежуточные шаги показываем, если их больше одного
+            for hop_url in chain[1:-1]:
+                header += f"⬇️\n{html.escape(hop_url)}\n"
+            header += f"⬇️\nВедёт на: {hbold(escaped_final)}\n"
         else:
             # Если редиректа нет или он скучный, показываем просто конечную ссылку
             # Обрезаем для красоты, если длинная
             short_view = escaped_final if len(escaped_final) <= 50 else escaped_final[:47] + "..."
             header = f"{hbold('Найдена ссылка:')}\n{short_view}\n"
 
-        # Проверка безопасности
-        is_safe, info = await check_url_safety(final_url, settings)
+        # Проверка безопасности: ждём проверки всех ссылок цепочки
+        verdicts = await asyncio.gather(*(safety_tasks[hop_url] for hop_url in chain))
+        is_safe, info = worst_verdict(verdicts)
 
         keyboard = None
         if is_safe is None:
@@ -156,6 +198,161 @@ async def format_qr_response(content: str, qr_type: str, settings):
     # --- ОСТАЛЬНОЕ ---
     return f"{hbold('Содержимое QR:')}\n{hcode(content)}", None
 
+def combine_replies(replies: list[tuple[str, InlineKeyboardMarkup | None]],
+                    labels: list[str] | None = None) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Склеивает ответы по нескольким кодам (одного фото или альбома) в одно сообщение."""
+    if len(replies) == 1:
+        return replies[0]
+
+    parts = []
+    rows = []
+    for number, (text, kb) in enumerate(replies, start=1):
+        title = f"{number}. {labels[number - 1]}" if labels else f"Код {number} из {len(replies)}"
+        parts.append(f"{hbold(title)}\n{text}")
+        # Кнопки нумеруем, чтобы было понятно, к какому коду они относятся
+        for row in (kb.inline_keyboard if kb else []):
+            rows.append([button.model_copy(update={"text": f"{number}. {button.text}"}) for button in row])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+    return "\n\n".join(parts), keyboard
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Режет длинный ответ на сообщения по границам абзацев (теги HTML внутри строк не рвутся)."""
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) <= limit or not current:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = paragraph
+    chunks.append(current)
+    return chunks
+
+
+# === Скачивание картинок ===
+def photo_size_ladder(photos: list[PhotoSize], min_side: int) -> list[PhotoSize]:
+    """
+    Возвращает размеры фото в порядке попыток: от наименьшего, у которого
+    длинная сторона не меньше min_side, до самого большого.
+    Telegram присылает размеры по возрастанию, так что лишних запросов не нужно.
+    """
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    for i, size in enumerate(ordered):
+        if max(size.width, size.height) >= min_side:
+            return ordered[i:]
+    return ordered[-1:]
+
+async def download_file_bytes(bot: Bot, file_id: str, max_size: int | None = None) -> bytearray:
+    """
+    Скачивает файл потоком в заранее выделенный буфер.
+    Бросает FileTooLarge, если файл больше max_size (проверяется и до, и во время загрузки).
+    """
+    with observe_stage("get_file"):
+        file = await bot.get_file(file_id)
+    if max_size is not None and file.file_size and file.file_size > max_size:
+        raise FileTooLarge(f"File is {file.file_size} bytes, limit is {max_size}")
+    with observe_stage("download"):
+        buffer = PreallocatedBuffer(file.file_size, max_size)
+        await bot.download_file(file.file_path, destination=buffer, seek=False)
+        return buffer.value()
+
+async def scan_images(ladders: list[list[PhotoSize | Document]], bot: Bot, settings, decode_engine: DecodeEngine,
+                      decode_cache: DecodeCache, admission: AdmissionController, chat_id: int) -> list[list[str] | None]:
+    """
+    Распознаёт одну картинку или альбом. Для каждой картинки передаётся список
+    файлов в порядке попыток (размеры фото от меньшего к большему; у документа
+    он один), последний — оригинал. Для каждой картинки возвращает тексты
+    найденных кодов (пустой список — кода нет) или None, если она не скачалась.
+
+    Идём раундами по размерам: в каждом раунде очередной размер всех ещё не
+    распознанных картинок скачивается одновременно и распознаётся одной пачкой.
+    Картинка, на которой нашёлся код, дальше не скачивается. Следующий размер
+    берём, только если декодер пометил результат incomplete (на кадре есть
+    похожие на QR области без прочитанного кода); находки размеров тогда
+    объединяются и кэшируются под хэшами всех скачанных копий.
+    DecodeQueueFull пробрасывается наверх; сбой пула или таймаут — DecodeFailed,
+    чтобы пользователь не получил «код не найден» вместо ошибки.
+    """
+    results: list[list[str] | None] = [None] * len(ladders)
+    pending: dict[int, list[PhotoSize | Document]] = {}
+    for index, ladder in enumerate(ladders):
+        # Эту картинку уже распознавали (например, её переслали из другого чата)
+        cached = decode_cache.get_by_file_id(ladder[-1].file_unique_id)
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending[index] = list(ladder)
+    ladders, originals = pending, [ladder[-1] for ladder in ladders]
+    digests: dict[int, list[str]] = {index: [] for index in ladders}
+
+    async def download(size: PhotoSize | Document) -> bytearray:
+        async with admission.slot("download", chat_id):
+            return await download_file_bytes(bot, size.file_id, settings.max_file_size)
+
+    def merge(index: int, contents: list[str]):
+        new = [content for content in contents if content not in results[index]]
+        results[index] = (results[index] + new)[:settings.decode_max_codes]
+
+    def finish(index: int):
+        del ladders[index]
+        if results[index]:
+            for digest in digests[index]:
+                decode_cache.put(digest, results[index], originals[index].file_unique_id)
+
+    while ladders:
+        sizes = {index: ladder.pop(0) for index, ladder in ladders.items()}
+        downloaded = await asyncio.gather(*(download(size) for size in sizes.values()), return_exceptions=True)
+
+        batch = []
+        for (index, size), photo_bytes in zip(sizes.items(), downloaded):
+            file_unique_id = originals[index].file_unique_id
+            if isinstance(photo_bytes, Exception):
+                logger.error(f"Ошибка скачивания: {photo_bytes}")
+                # Коды с меньшего размера (если были) остаются, но в кэш не идут
+                del ladders[index]
+                continue
+            if results[index] is None:
+                results[index] = []
+            digest = content_hash(photo_bytes)
+            cached = decode_cache.get_by_hash(digest, file_unique_id)
+            if cached is not None:
+                # В кэше — уже итог по всей картинке
+                merge(index, cached)
+                finish(index)
+            else:
+                digests[index].append(digest)
+                batch.append((index, photo_bytes))
+
+        if batch:
+            # Распознаём в пуле процессов, чтобы бот не зависал и пачки фото шли на все ядра.
+            # На одном фото бывает несколько кодов (флаеры, постеры) — берём все.
+            try:
+                async with admission.slot("decode", chat_id):
+                    with observe_stage("decode"):
+                        decoded = await decode_engine.decode_batch(
+                            [photo_bytes for _, photo_bytes in batch], settings, multi=True
+                        )
+            except DecodeQueueFull:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка распознавания: {e!r}")
+                raise DecodeFailed() from e
+
+            for (index, _), result in zip(batch, decoded):
+                DECODES.inc(stage=result.stage or "none")
+                contents = [code.content for code in result.codes]
+                if contents:
+                    logger.debug(f"{len(contents)} QR decoded at stage '{result.stage}'")
+                    merge(index, contents)
+                    if not result.incomplete or len(results[index]) >= settings.decode_max_codes:
+                        finish(index)
+
+        for index in [index for index, ladder in ladders.items() if not ladder]:
+            finish(index)
+
+    return results
+
 
 # === Хэндлеры ===
 async def start_handler(message: Message):
@@ -168,79 +365,225 @@ async def tips_handler(message: Message):
     kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Чаевые автору ☕", url="https://pay.cloudtips.ru/p/221ed8a2")]])
     await message.answer("Если вам нравится этот бот, вы можете поблагодарить автора чаевыми.\n\nВсе средства пойдут на оплату серверов и кофе ☕", reply_markup=kb)
 
-# Главный обработчик фото
-async def handle_photo(message: Message, bot: Bot, settings):
-    global total_scans, daily_scans, last_reset
+# Главный обработчик фото (и альбомов: их собирает MediaGroupMiddleware)
+async def handle_photo(message: Message, bot: Bot, settings, decode_engine: DecodeEngine, decode_cache: DecodeCache,
+                       http_session: aiohttp.ClientSession, admission: AdmissionController, stats_store: StatsStore,
+                       album: list[Message] | None = None):
+    # Защита от спама: альбом считается одной операцией
+    if await is_rate_limited(message.from_user.id, settings):
+        await message.answer("Слишком быстро! Подожди минуту.")
+        return
 
-    # Сброс статистики раз в день
-    if date.today() > last_reset:
-        daily_scans = 0
-        last_reset = date.today()
+    # Показываем статус "печатает..."
+    await bot.send_chat_action(chat_id=message.chat.id, action="typing")
+
+    # Начинаем с маленькой копии и берём побольше, только если код не нашёлся
+    ladders = [photo_size_ladder(item.photo, settings.photo_min_side) for item in (album or [message])]
+    try:
+        results = await scan_images(ladders, bot, settings, decode_engine, decode_cache, admission, message.chat.id)
+    except DecodeQueueFull:
+        await message.answer("Сейчас очень много фото, попробуй через минуту 🙏")
+        return
+    except DecodeFailed:
+        await message.answer("Не получилось обработать фото 😔 Попробуй ещё раз.")
+        return
 
-    # Защита от спама
-    if is_rate_limited(message.from_user.id, settings):
+    await answer_codes(message, results, settings, http_session, admission, stats_store)
+
+# Картинки, отправленные файлом (без сжатия)
+async def handle_document(message: Message, bot: Bot, settings, decode_engine: DecodeEngine, decode_cache: DecodeCache,
+                          http_session: aiohttp.ClientSession, admission: AdmissionController, stats_store: StatsStore,
+                          album: list[Message] | None = None):
+    documents = [item.document for item in (album or [message])]
+    # Размер известен из самого сообщения — слишком большие файлы даже не скачиваем
+    documents = [document for document in documents if (document.file_size or 0) <= settings.max_file_size]
+    if not documents:
+        limit_mb = settings.max_file_size // (1024 * 1024)
+        await message.answer(f"Файл слишком большой 😔 Пришли картинку до {limit_mb} МБ.")
+        return
+
+    if await is_rate_limited(message.from_user.id, settings):
         await message.answer("Слишком быстро! Подожди минуту.")
         return
 
-    # Показываем статус "печатает..."
     await bot.send_chat_action(chat_id=message.chat.id, action="typing")
 
     try:
-        # Скачиваем фото
-        file = await bot.get_file(message.photo[-1].file_id)
-        io_obj = BytesIO()
-        await bot.download_file(file.file_path, destination=io_obj)
-        photo_bytes = io_obj.getvalue()
-    except Exception as e:
-        logger.error(f"Ошибка скачивания: {e}")
-        await message.answer("Не удалось скачать фото 😔")
+        results = await scan_images([[document] for document in documents], bot, settings, decode_engine,
+                                    decode_cache, admission, message.chat.id)
+    except DecodeQueueFull:
+        await message.answer("Сейчас очень много фото, попробуй через минуту 🙏")
+        return
+    except DecodeFailed:
+        await message.answer("Не получилось обработать фото 😔 Попробуй ещё раз.")
         return
 
-    # Запускаем распознавание в отдельном потоке, чтобы бот не зависал
-    loop = asyncio.get_running_loop()
-    content = await loop.run_in_executor(
-        None, 
-        partial(decode_qr_locally, photo_bytes, settings)
-    )
-    # -----------------------------
+    await answer_codes(message, results, settings, http_session, admission, stats_store)
 
-    if content:
-        qr_type = detect_qr_type(content)
-        
-        # Если это ссылка, напишем "Проверяю...", так как это может занять время
-        status_msg = None
-        if qr_type == "url":
-            status_msg = await message.answer("⏳ Проверяю ссылку на вирусы...")
-        
-        text, kb = await format_qr_response(content, qr_type, settings)
-        
-        # Удаляем сообщение "Проверяю...", если оно было
-        if status_msg:
-            try:
-                await status_msg.delete()
-            except:
-                pass
+async def answer_codes(message: Message, results: list[list[str] | None], settings,
+                       http_session: aiohttp.ClientSession, admission: AdmissionController, stats_store: StatsStore):
+    """Отвечает одним сообщением по всем кодам, найденным на картинке или альбоме."""
+    if all(contents is None for contents in results):
+        await message.answer("Не удалось скачать фото 😔")
+        return
 
-        await message.answer(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+    # Все коды в порядке фото; одинаковые (один постер дважды) показываем один раз
+    codes: dict[str, str] = {}
+    for photo_number, contents in enumerate(results, start=1):
+        for code_number, content in enumerate(contents or [], start=1):
+            if len(contents) == 1:
+                label = f"Фото {photo_number}"
+            else:
+                label = f"Фото {photo_number}, код {code_number}"
+            codes.setdefault(content, label)
+
+    if not codes:
+        if len(results) > 1:
+            await message.answer("QR-коды не найдены на этих фото 😔 Попробуй сделать кадры четче.")
+        else:
+            await message.answer("QR-код не найден на этом фото 😔 Попробуй сделать кадр четче.")
+        return
 
-        total_scans += 1
-        daily_scans += 1
+    contents = list(codes)
+    qr_types = [detect_qr_type(content) for content in contents]
+
+    # Проверки ссылок — самая дорогая часть, у них свой лимит (по одной на ссылку)
+    url_allowed = [
+        qr_type == "url" and not await is_rate_limited(message.from_user.id, settings, "url")
+        for qr_type in qr_types
+    ]
+    url_limited = any(qr_type == "url" and not allowed for qr_type, allowed in zip(qr_types, url_allowed))
+
+    # Если есть ссылки, напишем "Проверяю...", так как это может занять время
+    status_msg = None
+    if any(url_allowed):
+        status_msg = await message.answer("⏳ Проверяю ссылку на вирусы...")
+
+    async def format_all():
+        # Все ссылки резолвятся и проверяются одновременно; параллельные проверки
+        # батчер Safe Browsing склеивает в один запрос.
+        # Ссылку сверх лимита показываем как текст, без проверки.
+        return await asyncio.gather(*(
+            format_qr_response(content, "text" if qr_type == "url" and not allowed else qr_type,
+                               settings, http_session)
+            for content, qr_type, allowed in zip(contents, qr_types, url_allowed)
+        ))
+
+    if any(url_allowed):
+        async with admission.slot("url_check", message.chat.id):
+            replies = await format_all()
     else:
-        await message.answer("QR-код не найден на этом фото 😔 Попробуй сделать кадр четче.")
+        replies = await format_all()
+    text, kb = combine_replies(replies, list(codes.values()) if len(results) > 1 else None)
+
+    not_found = [str(number) for number, contents in enumerate(results, start=1) if not contents]
+    if len(results) > 1 and not_found:
+        text += f"\n\nНа фото {', '.join(not_found)} код не найден."
+    if url_limited:
+        text += "\n\n⚠️ Ссылку не проверил — слишком много проверок подряд. Подожди минуту."
+
+    # Удаляем сообщение "Проверяю...", если оно было
+    if status_msg:
+        try:
+            await status_msg.delete()
+        except:
+            pass
+
+    with observe_stage("send_reply"):
+        chunks = split_message(text)
+        for chunk in chunks[:-1]:
+            await message.answer(chunk, parse_mode=ParseMode.HTML)
+        # Кнопки — под последним сообщением
+        await message.answer(chunks[-1], reply_markup=kb, parse_mode=ParseMode.HTML)
+
+    # Скан — картинка, на которой нашёлся код; коды считаются отдельно
+    type_by_content = dict(zip(contents, qr_types))
+    for image_contents in results:
+        if image_contents:
+            SCANS.inc()
+            CODES.inc(len(image_contents))
+            stats_store.record_scan([type_by_content[content] for content in image_contents])
 
 # Статистика только для тебя
-async def stats_handler(message: Message):
+async def stats_handler(message: Message, decode_cache: DecodeCache, admission: AdmissionController,
+                        stats_store: StatsStore):
     if message.from_user.id != OWNER_ID:
         return
-    text = f"Всего сканов: {total_scans}\nСегодня: {daily_scans}"
+    # Свежие суммы (с общим хранилищем — по всем воркерам)
+    await stats_store.flush()
+    by_type = ", ".join(
+        f"{name} {count}" for name, count in sorted(stats_store.by_type.items(), key=lambda item: -item[1])
+    )
+    by_day = "\n".join(f"  {day}: {count}" for day, count in stats_store.recent_days(7))
+    text = (
+        f"Всего сканов: {stats_store.total_scans} (кодов: {stats_store.total_codes})\nСегодня: {stats_store.today_scans}\n"
+        f"По типам: {by_type or '—'}\n"
+        f"За неделю:\n{by_day}\n\n"
+        f"Кэш распознавания: {decode_cache.hits} попаданий / {decode_cache.misses} промахов "
+        f"({decode_cache.hit_rate:.0%})\n"
+        f"Схлопнуто запросов: редиректы {resolve_flight.collapsed}/{resolve_flight.calls + resolve_flight.collapsed}, "
+        f"проверки {safety_flight.collapsed}/{safety_flight.calls + safety_flight.collapsed}\n"
+        f"Safe Browsing: {SAFE_BROWSING_REQUESTS.value(method='threatMatches:find'):.0f} запросов "
+        f"на {SAFE_BROWSING_URLS.value():.0f} ссылок, fullHashes "
+        f"{SAFE_BROWSING_REQUESTS.value(method='fullHashes:find'):.0f}, "
+        f"локально {THREAT_LIST_LOCAL_VERDICTS.value():.0f}\n"
+        f"Отказы по лимитам: {', '.join(f'{k} {v}' for k, v in rate_limiter.rejected.items()) or 0}\n"
+        f"Конвейер: {admission.pending} в работе, {admission.queue_depth} в очереди, сброшено {admission.shed}"
+    )
     await message.answer(text)
 
+# === Профилирование (только для владельца) ===
+MAX_PROFILE_SECONDS = 60
+# Ссылки на фоновые замеры, чтобы задачи не собрал GC
+profile_tasks: set[asyncio.Task] = set()
+
+def _profile_seconds(command: CommandObject, default: int = 10) -> int:
+    try:
+        seconds = int(command.args) if command.args else default
+    except ValueError:
+        seconds = default
+    return max(1, min(seconds, MAX_PROFILE_SECONDS))
+
+async def _send_profile_report(message: Message, report):
+    try:
+        text = await report
+    except ProfilerBusy:
+        text = "Уже идёт другой замер, подожди."
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}", exc_info=True)
+        text = "Не удалось снять профиль."
+    body = html.escape(text)[:MESSAGE_LIMIT - 20]
+    await message.answer(f"<pre>{body}</pre>", parse_mode=ParseMode.HTML)
+
+def _start_profile(message: Message, report):
+    # Замер идёт в фоне: воркер апдейтов не занят на всё время замера
+    task = asyncio.create_task(_send_profile_report(message, report))
+    profile_tasks.add(task)
+    task.add_done_callback(profile_tasks.discard)
+
+async def profile_handler(message: Message, command: CommandObject):
+    if message.from_user.id != OWNER_ID:
+        return
+    seconds = _profile_seconds(command)
+    await message.answer(f"Профилирую {seconds} с...")
+    _start_profile(message, profile_for(seconds))
+
+async def looplag_handler(message: Message, command: CommandObject):
+    if message.from_user.id != OWNER_ID:
+        return
+    seconds = _profile_seconds(command)
+    await message.answer(f"Слежу за event loop {seconds} с...")
+    _start_profile(message, monitor_loop_lag(seconds))
+
 # === Хэндлер для генерации QR ===
+# file_id уже отправленных QR (ключ — текст): Telegram хранит файл сам, повторно не загружаем
+qr_file_ids = TTLCache(max_items=10_000, ttl=30 * 24 * 3600)
+
 # 1. Ловит команду /qr
-async def cmd_qr_handler(message: Message, command: CommandObject, state: FSMContext):
+async def cmd_qr_handler(message: Message, command: CommandObject, state: FSMContext, settings):
     # Если пользователь ввел /qr ТЕКСТ
     if command.args:
-        await generate_and_send_qr(message, command.args)
+        await generate_and_send_qr(message, command.args, settings)
     # Если просто нажал /qr в меню
     else:
         await state.set_state(GenQR.waiting_for_text)
@@ -250,44 +593,255 @@ async def cmd_qr_handler(message: Message, command: CommandObject, state: FSMCon
         )
 
 # 2. Ловит текст, когда бот в режиме ожидания
-async def process_qr_text_input(message: Message, state: FSMContext):
+async def process_qr_text_input(message: Message, state: FSMContext, settings):
     if message.text == "❌ Отмена":
         await state.clear()
         await message.answer("Отменено.", reply_markup=ReplyKeyboardRemove())
         return
 
-    await generate_and_send_qr(message, message.text)
+    await generate_and_send_qr(message, message.text, settings)
     await state.clear()
 
 # 3. Общая функция рисования (чтобы не дублировать код)
-async def generate_and_send_qr(message: Message, text: str):
-    await message.bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
+async def generate_and_send_qr(message: Message, text: str, settings):
+    if await is_rate_limited(message.from_user.id, settings, "qr"):
+        await message.answer("Слишком быстро! Подожди минуту.", reply_markup=ReplyKeyboardRemove())
+        return
+
+    caption = f"✅ Готово:\n{hcode(text[:100])}"
     try:
-        photo_io = generate_qr_code(text)
-        photo_file = BufferedInputFile(photo_io.getvalue(), filename="qr.png")
+        # Этот QR уже отправляли — пересылаем по file_id, без рисования и загрузки
+        file_id = qr_file_ids.get(text)
+        if file_id is not None:
+            try:
+                await message.answer_photo(photo=file_id, caption=caption, reply_markup=ReplyKeyboardRemove())
+                return
+            except TelegramBadRequest:
+                qr_file_ids.pop(text)
+
+        await message.bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
+        png = await asyncio.to_thread(render_qr_png, text)
+        photo_file = BufferedInputFile(png, filename="qr.png")
         # ReplyKeyboardRemove уберет кнопку Отмена, если она была
-        await message.answer_photo(
+        sent = await message.answer_photo(
             photo=photo_file, 
-            caption=f"✅ Готово:\n{hcode(text[:100])}",
+            caption=caption,
             reply_markup=ReplyKeyboardRemove() 
         )
+        qr_file_ids.set(text, sent.photo[-1].file_id)
     except Exception as e:
         logger.error(f"Ошибка генерации: {e}")
         await message.answer("Ошибка генерации.", reply_markup=ReplyKeyboardRemove())
 
 
+# === Inline-режим: @bot текст ===
+# Незавершённый рендер по пользователю: новый запрос (следующая буква) отменяет старый
+inline_renders: dict[int, asyncio.Task] = {}
+# Один и тот же текст от разных пользователей рисуется и загружается один раз
+upload_flight = SingleFlight("inline_upload", SINGLEFLIGHT_CALLS)
+
+async def upload_qr(bot: Bot, text: str, settings) -> str:
+    """Рисует QR вне event loop, загружает его в служебный чат и возвращает file_id."""
+    png = await asyncio.to_thread(render_qr_png, text)
+    sent = await bot.send_photo(
+        settings.inline_upload_chat_id,
+        BufferedInputFile(png, filename="qr.png"),
+        disable_notification=True,
+    )
+    file_id = sent.photo[-1].file_id
+    qr_file_ids.set(text, file_id)
+    return file_id
+
+async def debounced_upload(bot: Bot, text: str, user_id: int, settings) -> str | None:
+    """Ждёт, пока пользователь допечатает, и загружает QR. None — лимит исчерпан."""
+    await asyncio.sleep(settings.inline_debounce)
+    if await is_rate_limited(user_id, settings, "qr"):
+        return None
+    return await upload_flight.do(text, upload_qr, bot, text, settings)
+
+async def inline_qr_handler(inline_query: InlineQuery, bot: Bot, settings):
+    text = inline_query.query.strip()[:settings.max_qr_content_length]
+    if not text or settings.inline_upload_chat_id is None:
+        await inline_query.answer(
+            [], cache_time=0,
+            button=InlineQueryResultsButton(text="Создать QR в чате с ботом", start_parameter="qr"),
+        )
+        return
+
+    user_id = inline_query.from_user.id
+    previous = inline_renders.pop(user_id, None)
+    if previous is not None:
+        previous.cancel()
+
+    file_id = qr_file_ids.get(text)
+    if file_id is None:
+        render = asyncio.create_task(debounced_upload(bot, text, user_id, settings))
+        inline_renders[user_id] = render
+        try:
+            # wait, а не await: отмена рендера более новым запросом не должна ронять хэндлер
+            await asyncio.wait({render})
+        finally:
+            if inline_renders.get(user_id) is render:
+                del inline_renders[user_id]
+            if not render.done():
+                render.cancel()
+        if render.cancelled():
+            # Пользователь печатает дальше — отвечать будет следующий запрос
+            return
+        try:
+            file_id = render.result()
+        except Exception as e:
+            logger.error(f"Ошибка inline-генерации: {e}")
+            file_id = None
+        if file_id is None:
+            await inline_query.answer([], cache_time=0)
+            return
+
+    result = InlineQueryResultCachedPhoto(
+        id=content_hash(text.encode()),
+        photo_file_id=file_id,
+        caption=text[:100],
+    )
+    # Одинаковые запросы разных пользователей Telegram сам отдаёт из кэша
+    await inline_query.answer([result], cache_time=settings.inline_cache_time, is_personal=False)
+
+
 # === Запуск бота ===
-async def run_bot(settings):
-    bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+def create_dispatcher(settings, storage: BaseStorage | None = None) -> Dispatcher:
+    # storage=None — MemoryStorage aiogram (состояние диалогов только в этом процессе)
+    dp = Dispatcher(storage=storage)
+    # Трасса на каждый апдейт: медленные попадают в лог с разбивкой по этапам
+    dp.update.outer_middleware(TracingMiddleware(settings.slow_update_threshold))
+    # Альбом собирается до admission: в конвейер он входит одним сообщением
+    dp.message.middleware(MediaGroupMiddleware(settings.media_group_window))
+    admission = AdmissionController(settings)
+    dp.message.middleware(AdmissionMiddleware(admission))
+    # Нужен и process_webhook_updates: фото сверх лимита не отдаются в отдельные задачи
+    dp["admission"] = admission
 
     dp.message.register(start_handler, Command("start"))
     dp.message.register(cmd_qr_handler, Command("qr"))
     dp.message.register(process_qr_text_input, GenQR.waiting_for_text)
     dp.message.register(help_handler, Command("help"))
     dp.message.register(tips_handler, Command("tips"))
-    dp.message.register(handle_photo, F.photo)
+    dp.message.register(handle_photo, F.photo, flags={"pipeline": True})
+    dp.message.register(handle_document, F.document.mime_type.startswith("image/"), flags={"pipeline": True})
     dp.message.register(stats_handler, Command("stats"))
-   
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, settings=settings)
+    dp.message.register(profile_handler, Command("profile"))
+    dp.message.register(looplag_handler, Command("looplag"))
+    dp.inline_query.register(inline_qr_handler)
+    return dp
+
+def is_pipeline_update(update: Update) -> bool:
+    """Фото или картинка-документ — то, что идёт в тяжёлый конвейер (скачивание и распознавание)."""
+    message = update.message
+    if message is None:
+        return False
+    if message.photo:
+        return True
+    return bool(message.document and (message.document.mime_type or "").startswith("image/"))
+
+async def process_webhook_updates(bot: Bot, dp: Dispatcher, updates: asyncio.Queue, concurrency: int):
+    """
+    Обрабатывает апдейты из вебхука на текущем event loop.
+    Одновременно работает не больше concurrency апдейтов.
+
+    Фото не занимают воркеры: каждое уходит в свою задачу. Сверх
+    admission_max_pending admission сразу отвечает «занят», и ответ тоже
+    идёт в задаче, поэтому текст и /qr не стоят в очереди за фото.
+    Только если задач больше лимита с запасом, фото обрабатывается в
+    воркере — это обратное давление на очередь вебхука.
+    """
+    admission: AdmissionController = dp["admission"]
+    max_tasks = admission.max_pending + concurrency
+    pipeline_tasks: set[asyncio.Task] = set()
+
+    async def feed(update: Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта: {e}", exc_info=True)
+
+    async def feed_pipeline(update: Update):
+        try:
+            await feed(update)
+        finally:
+            updates.task_done()
+
+    async def worker():
+        while True:
+            data = await updates.get()
+            try:
+                update = Update.model_validate(data, context={"bot": bot})
+            except Exception as e:
+                logger.error(f"Некорректный апдейт: {e}")
+                updates.task_done()
+                continue
+            if is_pipeline_update(update) and len(pipeline_tasks) < max_tasks:
+                task = asyncio.create_task(feed_pipeline(update))
+                pipeline_tasks.add(task)
+                task.add_done_callback(pipeline_tasks.discard)
+                continue
+            # Лёгкие апдейты, а также фото сверх max_tasks
+            try:
+                await feed(update)
+            finally:
+                updates.task_done()
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        for task in list(pipeline_tasks):
+            task.cancel()
+        await asyncio.gather(*pipeline_tasks, return_exceptions=True)
+
+async def run_bot(settings, http_session: aiohttp.ClientSession, webhook_updates: asyncio.Queue | None = None):
+    """
+    Поднимает сервисы и обрабатывает апдейты: через long polling или,
+    если передана очередь webhook_updates, — из вебхука.
+    """
+    session = None
+    if settings.telegram_api_url:
+        # Свой Bot API сервер (локальный telegram-bot-api или заглушка для нагрузочных тестов)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    bot = Bot(token=settings.bot_token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Лимиты, кэш ссылок, счётчики и FSM — в памяти или в общем для воркеров хранилище
+    state = await asyncio.to_thread(create_state_backend, settings)
+    rate_limiter.backend = state.rate_limit_backend()
+    dp = create_dispatcher(settings, storage=state.fsm_storage())
+
+    decode_engine = DecodeEngine.from_settings(settings)
+    decode_cache = DecodeCache.from_settings(settings)
+    await decode_engine.start()
+    await setup_url_cache(settings, state)
+    await start_threat_lists(settings, http_session)
+    rate_limiter.start_eviction(settings.rate_limit_eviction_interval)
+    configure_render_cache(settings)
+    qr_file_ids.max_items = settings.qr_file_id_cache_size
+    stats_store = StatsStore(settings.stats_file_path, state.counters())
+    await stats_store.load()
+    stats_store.start(settings.stats_flush_interval)
+
+    dp.workflow_data.update(
+        settings=settings,
+        decode_engine=decode_engine,
+        decode_cache=decode_cache,
+        http_session=http_session,
+        stats_store=stats_store,
+    )
+    try:
+        if webhook_updates is None:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+        else:
+            await process_webhook_updates(bot, dp, webhook_updates, settings.webhook_max_concurrency)
+    finally:
+        await decode_engine.shutdown()
+        await stop_threat_lists()
+        await close_url_cache()
+        await rate_limiter.close()
+        # Последний сброс статистики на диск перед остановкой
+        await stats_store.close()
+        await dp.storage.close()
+        await state.close()
+        await bot.session.close()
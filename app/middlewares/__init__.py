@@ -0,0 +1,2 @@
+# app/middlewares/__init__.py
+# aiogram middlewares
@@ -0,0 +1,147 @@
+# app/middlewares/admission.py
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+from app.services.metrics import PIPELINE_PENDING, PIPELINE_QUEUE_DEPTH, PIPELINE_SHED
+from app.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Очередь переполнена — запрос отбрасываем сразу."""
+
+
+class FairStageLimiter:
+    """
+    Ограничивает число одновременных операций одного этапа (скачивание,
+    распознавание, проверка ссылок). Ожидающие стоят в очередях по чатам,
+    свободный слот отдаётся чатам по кругу — один чат с альбомом из 50 фото
+    не задерживает всех остальных.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.active = 0
+        self._queues: OrderedDict[int, deque[asyncio.Future]] = OrderedDict()
+        self.waiting = 0
+
+    async def acquire(self, chat_id: int):
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append(future)
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже передали нам — возвращаем его
+                self.release()
+            else:
+                self._discard(chat_id, future)
+            raise
+
+    def release(self):
+        while self._queues:
+            chat_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.waiting -= 1
+            # Чат уходит в конец круга; пустую очередь удаляем
+            del self._queues[chat_id]
+            if queue:
+                self._queues[chat_id] = queue
+            if not future.done():
+                # Слот переходит ожидающему, active не меняется
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, chat_id: int, future: asyncio.Future):
+        queue = self._queues.get(chat_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[chat_id]
+
+
+class AdmissionController:
+    """Лимиты конвейера обработки фото и счётчики отказов."""
+
+    def __init__(self, settings):
+        self.max_pending = settings.admission_max_pending
+        self.pending = 0
+        self.shed = 0
+        self.stages = {
+            "download": FairStageLimiter("download", settings.admission_downloads),
+            "decode": FairStageLimiter("decode", settings.admission_decodes),
+            "url_check": FairStageLimiter("url_check", settings.admission_url_checks),
+        }
+        PIPELINE_PENDING.set_function(lambda: self.pending)
+        PIPELINE_QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(stage.waiting for stage in self.stages.values())
+
+    def try_admit(self) -> bool:
+        if self.pending >= self.max_pending:
+            self.shed += 1
+            PIPELINE_SHED.inc()
+            return False
+        self.pending += 1
+        return True
+
+    def leave(self):
+        self.pending -= 1
+
+    @asynccontextmanager
+    async def slot(self, stage: str, chat_id: int):
+        limiter = self.stages[stage]
+        with span(f"{stage}_wait"):
+            await limiter.acquire(chat_id)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Пропускает в конвейер не больше admission_max_pending сообщений сразу.
+    Лишние получают короткий ответ «занят» без скачивания и распознавания.
+    Работает только для хэндлеров с флагом pipeline.
+    """
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        data["admission"] = self.controller
+        if not get_flag(data, "pipeline"):
+            return await handler(event, data)
+
+        if not self.controller.try_admit():
+            logger.warning(f"Load shedding: {self.controller.pending} updates in pipeline")
+            if isinstance(event, Message):
+                await event.answer("Сейчас очень много фото, попробуй через минуту 🙏")
+            return None
+
+        try:
+            return await handler(event, data)
+        finally:
+            self.controller.leave()
@@ -0,0 +1,54 @@
+# app/middlewares/album.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+# Больше фото в одном альбоме Telegram не присылает
+MAX_ALBUM_SIZE = 10
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """
+    Собирает фото одного альбома (общий media_group_id) в одну пачку.
+
+    Telegram присылает альбом отдельными апдейтами почти одновременно.
+    Первое сообщение ждёт, пока новые не перестанут приходить в течение
+    window секунд, и вызывает хэндлер один раз — со всеми сообщениями в
+    data["album"]. Остальные сообщения альбома хэндлер не вызывают.
+    Работает только для хэндлеров с флагом pipeline.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._groups: dict[tuple[int, str], list[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Message) or not event.media_group_id or not get_flag(data, "pipeline"):
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(event)
+            return None
+
+        group = self._groups[key] = [event]
+        try:
+            # Ждём, пока альбом не перестанет пополняться
+            seen = 0
+            while len(group) != seen and len(group) < MAX_ALBUM_SIZE:
+                seen = len(group)
+                await asyncio.sleep(self.window)
+        finally:
+            del self._groups[key]
+
+        group.sort(key=lambda message: message.message_id)
+        data["album"] = group
+        return await handler(group[0], data)
@@ -0,0 +1,49 @@
+# app/middlewares/tracing.py
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from app.services.tracing import Trace, current_trace
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(update: Update) -> str:
+    """Короткое имя апдейта для лога: тип события и, для сообщений, что в нём."""
+    message = update.message
+    if message is None:
+        return update.event_type
+    if message.photo:
+        return "message/photo"
+    if message.document:
+        return "message/document"
+    if message.text and message.text.startswith("/"):
+        return f"message/{message.text.split()[0]}"
+    return "message/text"
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Открывает трассу на каждый апдейт (outer-middleware на dp.update).
+    Апдейты дольше threshold секунд логируются с разбивкой по этапам.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        trace = Trace(_describe(event) if isinstance(event, Update) else type(event).__name__)
+        token = current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            current_trace.reset(token)
+            elapsed = trace.elapsed
+            if elapsed >= self.threshold:
+                update_id = getattr(event, "update_id", "?")
+                logger.warning(f"Slow update {update_id} ({trace.name}) {elapsed:.3f}s: {trace.breakdown()}")
@@ -0,0 +1,59 @@
+# app/services/decode_cache.py
+import hashlib
+
+from app.services.metrics import CACHE_LOOKUPS
+from app.utils.cache import TTLCache
+
+
+def content_hash(image_bytes: bytes) -> str:
+    """Быстрый хэш содержимого картинки."""
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+class DecodeCache:
+    """
+    Кэш результатов распознавания.
+
+    Одни и те же скриншоты с QR пересылают из чата в чат. Первый ключ —
+    file_unique_id из Telegram (попадание — не нужно даже скачивать файл),
+    второй — хэш скачанных байтов (тот же файл, загруженный заново).
+    Значение — тексты всех кодов с картинки в порядке чтения.
+    """
+
+    def __init__(self, max_items: int, ttl: float):
+        self._by_file_id = TTLCache(max_items, ttl)
+        self._by_hash = TTLCache(max_items, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "DecodeCache":
+        return cls(settings.decode_cache_size, settings.decode_cache_ttl)
+
+    def get_by_file_id(self, file_unique_id: str) -> list[str] | None:
+        contents = self._by_file_id.get(file_unique_id)
+        if contents is not None:
+            self.hits += 1
+        CACHE_LOOKUPS.inc(cache="decode_file_id", result="miss" if contents is None else "hit")
+        return contents
+
+    def get_by_hash(self, digest: str, file_unique_id: str | None = None) -> list[str] | None:
+        contents = self._by_hash.get(digest)
+        CACHE_LOOKUPS.inc(cache="decode_hash", result="miss" if contents is None else "hit")
+        if contents is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if file_unique_id:
+            self._by_file_id.set(file_unique_id, contents)
+        return contents
+
+    def put(self, digest: str, contents: list[str], file_unique_id: str | None = None):
+        self._by_hash.set(digest, contents)
+        if file_unique_id:
+            self._by_file_id.set(file_unique_id, contents)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
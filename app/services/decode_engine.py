@@ -0,0 +1,180 @@
+# app/services/decode_engine.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from app.services.qr_decoder import DecodeResult, decode_qr_batch, decode_qr_ladder
+
+logger = logging.getLogger(__name__)
+
+
+class DecodeQueueFull(Exception):
+    """Очередь распознавания переполнена — задачу не принимаем."""
+
+
+class DecodeFailed(Exception):
+    """Распознавание не состоялось (таймаут, сбой пула) — это не «кода нет»."""
+
+
+def _warm_up_worker(pids):
+    """Инициализатор процесса: сообщает свой pid и заранее импортирует тяжёлые библиотеки."""
+    pids.put(os.getpid())
+    import PIL.Image  # noqa: F401
+    from pyzbar import pyzbar  # noqa: F401
+
+
+def _ping() -> bool:
+    return True
+
+
+class DecodeEngine:
+    """
+    Пул процессов для распознавания QR.
+
+    PIL и pyzbar держат GIL, поэтому в потоках фото одной пачки
+    обрабатываются по очереди. Здесь каждое фото уходит в отдельный процесс,
+    число задач в работе и в очереди ограничено, а зависший воркер убивается
+    по таймауту вместе с пулом. Чужие задачи, попавшие под перезапуск,
+    один раз повторяются на новом пуле.
+
+    В пул одновременно отдаётся не больше задач, чем воркеров, остальные
+    ждут здесь. Так таймаут считается с начала работы задачи, а не с
+    постановки в очередь, и задача, просто ждавшая своей очереди, не
+    перезапускает пул.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = max(1, workers)
+        self.queue_size = max(self.workers, queue_size)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._running = asyncio.Semaphore(self.workers)  # задачи, отданные в пул
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+        # pid'ы воркеров каждого пула: их сообщает инициализатор
+        self._pids: dict[ProcessPoolExecutor, multiprocessing.SimpleQueue] = {}
+
+    @classmethod
+    def from_settings(cls, settings) -> "DecodeEngine":
+        return cls(
+            workers=settings.decode_workers,
+            queue_size=settings.decode_queue_size,
+            timeout=settings.decode_timeout,
+        )
+
+    @property
+    def pending(self) -> int:
+        """Сколько задач сейчас в очереди или в работе."""
+        return self._pending
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn, а не fork: в родительском процессе крутится event loop и потоки aiohttp
+        context = multiprocessing.get_context("spawn")
+        pids = context.SimpleQueue()
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_warm_up_worker,
+            initargs=(pids,),
+        )
+        self._pids[executor] = pids
+        return executor
+
+    async def start(self):
+        """Поднимает пул и прогревает все воркеры."""
+        self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)
+            ))
+            logger.info(f"Decode engine started with {self.workers} workers.")
+        except Exception as e:
+            logger.error(f"Decode engine warm-up failed: {e}")
+
+    async def shutdown(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+            self._pids.pop(executor, None)
+            logger.info("Decode engine stopped.")
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        """Создаёт новый пул, а старый останавливает и убивает его процессы (в т.ч. зависший)."""
+        if executor is not self._executor:
+            # Пул уже пересоздан другой задачей
+            return
+        self._executor = self._create_executor()
+        executor.shutdown(wait=False, cancel_futures=True)
+        # shutdown не ждёт и не прерывает зависшую задачу — добиваем воркеры сами
+        pids = self._pids.pop(executor)
+        while not pids.empty():
+            try:
+                os.kill(pids.get(), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    async def run(self, func, *args, timeout: float | None = None):
+        """
+        Выполняет func(*args) в пуле.
+        Бросает DecodeQueueFull, если очередь заполнена, asyncio.TimeoutError, если
+        задача работает дольше timeout (ожидание свободного воркера не считается),
+        и BrokenProcessPool, если пул упал и повтор не помог.
+        """
+        timeout = timeout or self.timeout
+        if self._executor is None:
+            raise RuntimeError("Decode engine is not started")
+        if self._slots.locked():
+            raise DecodeQueueFull()
+
+        async with self._slots, self._running:
+            self._pending += 1
+            try:
+                for attempt in range(2):
+                    executor = self._executor
+                    try:
+                        future = asyncio.wrap_future(executor.submit(partial(func, *args)))
+                        return await asyncio.wait_for(future, timeout=timeout)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"Decode job exceeded {timeout}s, restarting worker pool.")
+                        self._restart(executor)
+                        raise
+                    except (BrokenProcessPool, asyncio.CancelledError) as e:
+                        if isinstance(e, asyncio.CancelledError) and asyncio.current_task().cancelling():
+                            # Отменили нас самих, а не задачу в пуле
+                            raise
+                        if executor is not self._executor and attempt == 0:
+                            # Пул перезапустили из-за чужой задачи — повторяем на новом
+                            logger.info("Decode pool was restarted under a job, retrying it.")
+                            continue
+                        logger.error("Decode worker pool is broken, restarting.")
+                        self._restart(executor)
+                        raise BrokenProcessPool("Decode worker pool is broken") from e
+            finally:
+                self._pending -= 1
+
+    async def decode(self, image_bytes: bytes, settings, multi: bool = False) -> DecodeResult:
+        return await self.run(decode_qr_ladder, image_bytes, settings, multi)
+
+    async def decode_batch(self, images: list[bytes], settings, multi: bool = False) -> list[DecodeResult]:
+        """
+        Распознаёт пачку картинок. Пачка делится на столько задач, сколько
+        воркеров: меньше пересылок между процессами, но заняты все ядра.
+        """
+        if not images:
+            return []
+        chunks = [images[i::self.workers] for i in range(min(self.workers, len(images)))]
+        results = await asyncio.gather(*(
+            self.run(decode_qr_batch, chunk, settings, multi, timeout=self.timeout * len(chunk))
+            for chunk in chunks
+        ))
+        # Возвращаем результаты в исходном порядке
+        ordered = [None] * len(images)
+        for offset, chunk_results in enumerate(results):
+            ordered[offset::self.workers] = chunk_results
+        return ordered
@@ -0,0 +1,50 @@
+# app/services/fsm_storage.py
+import json
+from typing import Any, Mapping
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from app.utils.sqlite import SQLiteDatabase
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в общей SQLite: диалог /qr, начатый в одном
+    процессе, продолжается в любом другом. Пишется сразу — следующее
+    сообщение пользователя может прийти в соседний воркер.
+    """
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        db.call(lambda conn: conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.db.run(lambda conn: conn.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self.key_builder.build(key), value),
+        ))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        row = await self.db.run(lambda conn: conn.execute(
+            "SELECT state FROM fsm WHERE key = ?", (self.key_builder.build(key),)
+        ).fetchone())
+        return None if row is None else row[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.db.run(lambda conn: conn.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self.key_builder.build(key), json.dumps(dict(data))),
+        ))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        row = await self.db.run(lambda conn: conn.execute(
+            "SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),)
+        ).fetchone())
+        return {} if row is None else json.loads(row[0])
+
+    async def close(self) -> None:
+        # Соединением владеет бэкенд состояния
+        pass
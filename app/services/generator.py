@@ -1,26 +1,69 @@
+import struct
+import threading
+import zlib
 import qrcode
-from io import BytesIO
+from app.utils.cache import TTLCache
 
-def generate_qr_code(text: str) -> BytesIO:
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Готовые PNG: популярные тексты (ссылка на канал, Wi-Fi кафе) рисуются один раз
+render_cache = TTLCache(max_items=512, ttl=24 * 3600, max_bytes=32 * 1024 * 1024)
+# render_qr_png зовут из asyncio.to_thread, а TTLCache не потокобезопасен
+_render_cache_lock = threading.Lock()
+
+
+def configure_render_cache(settings):
+    with _render_cache_lock:
+        render_cache.max_items = settings.qr_render_cache_size
+        render_cache.max_bytes = settings.qr_render_cache_bytes
+
+
+def render_qr_png(text: str, box_size: int = 10, border: int = 4,
+                  error_correction: int = qrcode.constants.ERROR_CORRECT_L) -> bytes:
     """
-    Создает QR-код из текста и возвращает его как байтовый объект (в памяти).
+    PNG с QR-кодом; повторные запросы с теми же параметрами берутся из кэша.
+    Можно звать из потоков: кэш под блокировкой, сам рендер — без неё.
     """
-    # Создаем QR-код
+    key = (text, box_size, border, error_correction)
+    with _render_cache_lock:
+        png = render_cache.get(key)
+    if png is None:
+        png = _render_png(text, box_size, border, error_correction)
+        with _render_cache_lock:
+            render_cache.set(key, png)
+    return png
+
+
+def _render_png(text: str, box_size: int, border: int, error_correction: int) -> bytes:
+    # Создаем QR-код; рисуем сами, без PIL
     qr = qrcode.QRCode(
         version=None,  # Автоматический размер
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
     )
     qr.add_data(text)
     qr.make(fit=True)
+    matrix = qr.get_matrix()  # уже с рамкой
+
+    # 1 бит на пиксель: 0 — чёрный, 1 — белый. Каждый модуль растягиваем
+    # на box_size пикселей по горизонтали, а готовую строку — по вертикали.
+    size = len(matrix) * box_size
+    padding = -size % 8
+    rows = []
+    for modules in matrix:
+        bits = "".join(("0" if dark else "1") * box_size for dark in modules) + "1" * padding
+        scanline = b"\x00" + int(bits, 2).to_bytes((size + padding) // 8, "big")  # фильтр None
+        rows.append(scanline * box_size)
+
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)  # 1 бит, оттенки серого
+    return b"".join((
+        PNG_SIGNATURE,
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 9)),
+        _png_chunk(b"IEND", b""),
+    ))
 
-    # Создаем картинку (черный код, белый фон)
-    img = qr.make_image(fill_color="black", back_color="white")
 
-    # Сохраняем в память (не на диск!)
-    bio = BytesIO()
-    img.save(bio)
-    bio.seek(0)
-    
-    return bio
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
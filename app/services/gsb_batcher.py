@@ -0,0 +1,104 @@
+# app/services/gsb_batcher.py
+import asyncio
+import logging
+from aiohttp import ClientSession, ClientTimeout
+from app.services.metrics import SAFE_BROWSING_REQUESTS, SAFE_BROWSING_URLS
+
+logger = logging.getLogger(__name__)
+
+THREAT_TYPES = ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"]
+
+
+def build_threat_matches_payload(urls: list[str]) -> dict:
+    return {
+        "client": {
+            "clientId": "qrscanerpro",
+            "clientVersion": "2.0.0"
+        },
+        "threatInfo": {
+            "threatTypes": THREAT_TYPES,
+            "platformTypes": ["ANY_PLATFORM"],
+            "threatEntryTypes": ["URL"],
+            "threatEntries": [{"url": url} for url in urls]
+        }
+    }
+
+
+class SafeBrowsingBatcher:
+    """
+    Склеивает одновременные проверки ссылок в один запрос threatMatches:find.
+
+    API принимает до 500 адресов за раз. Вызовы копятся в течение короткого
+    окна (или до заполнения пачки), уходят одним POST, а ответ раскладывается
+    по ожидающим future по полю matches[].threat.url.
+    """
+
+    def __init__(self, session: ClientSession, settings):
+        self.session = session
+        self.settings = settings
+        self.window = settings.gsb_batch_window_ms / 1000
+        self.max_size = settings.gsb_batch_max_size
+        self._pending: dict[str, list[asyncio.Future]] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def check(self, url: str) -> tuple[bool | None, str | None]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(url, []).append(future)
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._send(batch))
+        # Держим ссылку на задачу, иначе её может собрать GC
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: dict[str, list[asyncio.Future]]):
+        try:
+            results = await self._lookup(list(batch))
+        except asyncio.TimeoutError:
+            logger.warning("Safe Browsing API request timed out")
+            results = {url: (None, "Request timeout") for url in batch}
+        except Exception as e:
+            logger.error(f"Error checking URL safety: {e}")
+            results = {url: (None, "API error") for url in batch}
+
+        for url, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results[url])
+
+    async def _lookup(self, urls: list[str]) -> dict[str, tuple[bool | None, str | None]]:
+        api_url = f"{self.settings.gsb_api_url}/threatMatches:find?key={self.settings.gsb_api_key}"
+        timeout = ClientTimeout(total=self.settings.request_timeout)
+        SAFE_BROWSING_REQUESTS.inc(method="threatMatches:find")
+        SAFE_BROWSING_URLS.inc(len(urls))
+
+        async with self.session.post(api_url, json=build_threat_matches_payload(urls), timeout=timeout) as resp:
+            if resp.status != 200:
+                logger.warning(f"Safe Browsing API returned status {resp.status}")
+                return {url: (None, f"API error: {resp.status}") for url in urls}
+            result = await resp.json()
+
+        threats = {}
+        for match in result.get('matches', []):
+            matched_url = match.get('threat', {}).get('url')
+            threats.setdefault(matched_url, match.get('threatType', 'UNKNOWN'))
+
+        return {
+            url: (False, threats[url]) if url in threats else (True, None)
+            for url in urls
+        }
@@ -0,0 +1,27 @@
+# app/services/http_client.py
+import logging
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+logger = logging.getLogger(__name__)
+
+
+def create_http_session(settings) -> ClientSession:
+    """
+    Общая сессия aiohttp на всё приложение.
+
+    Пул соединений с keep-alive и кэшем DNS: повторные запросы к тем же
+    хостам (Safe Browsing, сокращатели ссылок) не платят за новые
+    TCP/TLS-рукопожатия. Создаётся при старте, закрывается при остановке.
+    """
+    connector = TCPConnector(
+        limit=settings.http_pool_size,
+        limit_per_host=settings.http_pool_per_host,
+        ttl_dns_cache=settings.http_dns_cache_ttl,
+        keepalive_timeout=settings.http_keepalive_timeout,
+        enable_cleanup_closed=True,
+    )
+    logger.info("HTTP client session created.")
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=settings.request_timeout),
+    )
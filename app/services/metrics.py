@@ -0,0 +1,191 @@
+# app/services/metrics.py
+"""
+Минимальные метрики в текстовом формате Prometheus: счётчики, гистограммы
+и gauge-и. Без внешних зависимостей; всё живёт в одном процессе и
+отдаётся через /metrics в main.py.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from app.services.tracing import record_span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение берётся из функции в момент отдачи метрик."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._function = None
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self) -> list[str]:
+        if self._function is None:
+            return []
+        return super().render() + [f"{self.name} {_format_value(self._function())}"]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound) if bound != float("inf") else "+Inf"}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# === Метрики бота ===
+STAGE_SECONDS = Histogram(
+    "qrbot_stage_seconds", "Latency of photo pipeline stages", ("stage",)
+)
+DECODES = Counter(
+    "qrbot_decodes_total", "Decode attempts by the ladder stage that succeeded (none = not found)", ("stage",)
+)
+CACHE_LOOKUPS = Counter(
+    "qrbot_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result")
+)
+RATE_LIMITED = Counter(
+    "qrbot_rate_limited_total", "Requests rejected by the rate limiter", ("action",)
+)
+SCANS = Counter(
+    "qrbot_scans_total", "Answered images with at least one code"
+)
+CODES = Counter(
+    "qrbot_codes_total", "QR codes found on answered images"
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "qrbot_singleflight_calls_total", "Single-flight calls: run, or collapsed into one in flight", ("flight", "result")
+)
+SAFE_BROWSING_REQUESTS = Counter(
+    "qrbot_safebrowsing_requests_total", "Requests sent to the Safe Browsing API by method", ("method",)
+)
+SAFE_BROWSING_URLS = Counter(
+    "qrbot_safebrowsing_urls_total", "URLs checked via threatMatches:find (batched into fewer requests)"
+)
+THREAT_LIST_LOCAL_VERDICTS = Counter(
+    "qrbot_threat_list_local_verdicts_total", "URLs judged safe by the local threat lists without an API call"
+)
+PIPELINE_PENDING = Gauge("qrbot_pipeline_pending", "Photo updates admitted into the pipeline")
+PIPELINE_QUEUE_DEPTH = Gauge("qrbot_pipeline_queue_depth", "Pipeline operations waiting for a stage slot")
+PIPELINE_SHED = Counter("qrbot_pipeline_shed_total", "Photo updates rejected by load shedding")
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Время этапа конвейера: в qrbot_stage_seconds и спаном в трассу апдейта."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        record_span(stage, started, elapsed)
+
+
+def render_metrics() -> str:
+    return registry.render()
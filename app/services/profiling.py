@@ -0,0 +1,115 @@
+# app/services/profiling.py
+"""
+Профилирование «на живую» по команде владельца: cProfile или замер лага
+event loop на N секунд. Одновременно работает только один замер.
+"""
+import asyncio
+import cProfile
+import logging
+import re
+import statistics
+import time
+from contextlib import contextmanager
+
+# Сообщение asyncio в debug-режиме о долгом колбэке
+SLOW_CALLBACK_MESSAGE = "Executing %s took %.3f seconds"
+# Задержка, которую считаем заметным зависанием event loop
+STALL_THRESHOLD = 0.1
+
+_busy = False
+
+
+class ProfilerBusy(Exception):
+    """Другой замер ещё идёт."""
+
+
+@contextmanager
+def _exclusive():
+    global _busy
+    if _busy:
+        raise ProfilerBusy()
+    _busy = True
+    try:
+        yield
+    finally:
+        _busy = False
+
+
+async def profile_for(seconds: float, limit: int = 15) -> str:
+    """Включает cProfile на seconds секунд и возвращает самые «горячие» функции (по собственному времени)."""
+    with _exclusive():
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    profiler.create_stats()
+    # (файл, строка, функция) -> (примитивные вызовы, все вызовы, собственное время, общее время, вызывающие)
+    rows = sorted(profiler.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    lines = [f"cProfile за {seconds:g} с, топ {limit} по собственному времени:"]
+    for (filename, line, function), (_, calls, own, total, _) in rows:
+        where = f"{filename.rsplit('/', 1)[-1]}:{line}" if line else filename
+        lines.append(f"{own:7.3f}s {total:7.3f}s {calls:>7}  {function} ({where})")
+    return "\n".join(lines)
+
+
+class _SlowCallbacks(logging.Handler):
+    """Собирает сообщения asyncio о долгих колбэках, группируя по корутине."""
+
+    def __init__(self):
+        super().__init__()
+        self.durations: dict[str, list[float]] = {}
+
+    def emit(self, record: logging.LogRecord):
+        if record.msg != SLOW_CALLBACK_MESSAGE or not record.args:
+            return
+        handle, duration = record.args
+        match = re.search(r"coro=<([\w.]+)\(\)", str(handle))
+        name = match.group(1) if match else str(handle)[:80]
+        self.durations.setdefault(name, []).append(duration)
+
+
+async def monitor_loop_lag(seconds: float, interval: float = 0.01, slow_callback: float = 0.05,
+                           limit: int = 10) -> str:
+    """
+    Замеряет лаг event loop на seconds секунд и на это время включает
+    debug-режим asyncio, чтобы узнать, какие колбэки держат loop дольше slow_callback.
+    """
+    with _exclusive():
+        loop = asyncio.get_running_loop()
+        previous_debug, previous_threshold = loop.get_debug(), loop.slow_callback_duration
+        collector = _SlowCallbacks()
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.addHandler(collector)
+        loop.slow_callback_duration = slow_callback
+        loop.set_debug(True)
+
+        samples = []
+        try:
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                samples.append(time.perf_counter() - started - interval)
+        finally:
+            loop.set_debug(previous_debug)
+            loop.slow_callback_duration = previous_threshold
+            asyncio_logger.removeHandler(collector)
+
+    quantiles = statistics.quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    stalls = sum(1 for lag in samples if lag >= STALL_THRESHOLD)
+    lines = [
+        f"Лаг event loop за {seconds:g} с ({len(samples)} замеров):",
+        f"p50 {quantiles[49] * 1000:.1f} ms, p99 {quantiles[98] * 1000:.1f} ms, max {max(samples) * 1000:.1f} ms",
+        f"Зависаний дольше {STALL_THRESHOLD * 1000:.0f} ms: {stalls}",
+    ]
+    if collector.durations:
+        lines.append(f"Колбэки дольше {slow_callback * 1000:.0f} ms (всего, раз, макс):")
+        ranked = sorted(collector.durations.items(), key=lambda item: sum(item[1]), reverse=True)[:limit]
+        for name, durations in ranked:
+            lines.append(f"{sum(durations):7.3f}s {len(durations):>5} {max(durations):7.3f}s  {name}")
+    else:
+        lines.append(f"Колбэков дольше {slow_callback * 1000:.0f} ms не было.")
+    return "\n".join(lines)
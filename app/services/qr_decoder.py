@@ -1,40 +1,235 @@
 import logging
-from PIL import Image
+import math
+import time
+from typing import NamedTuple
+from PIL import Image, ImageChops, ImageFilter, ImageOps
 import io
 from pyzbar import pyzbar
+from app.services.qr_locator import crop_region, find_qr_regions
 
 logger = logging.getLogger(__name__)
 
+# В режиме multi после удачной ступени можно перейти к следующей из этих,
+# но только если на кадре остались похожие на QR области без прочитанного кода
+MULTI_STAGES = ("downscaled", "roi", "full")
+
+# Углы для последней ступени: pyzbar сам читает повороты на 90°, а вот наклонённые коды — хуже
+ROTATION_ANGLES = (45, 20, -20)
+
+Box = tuple[int, int, int, int]  # left, top, width, height в координатах исходного кадра
+
+
+class QRCode(NamedTuple):
+    content: str
+    box: Box | None  # None — код нашёлся на повёрнутой копии
+
+
+class DecodeResult(NamedTuple):
+    content: str | None
+    stage: str | None  # на какой ступени нашёлся код
+    codes: tuple[QRCode, ...] = ()  # все коды кадра (только в режиме multi)
+    incomplete: bool = False  # multi: остались области-кандидаты без кода — кадр покрупнее может помочь
+
+
 def decode_qr_locally(image_bytes: bytes, settings) -> str | None:
     """
     Декодирует QR-код из байтов изображения с помощью библиотеки pyzbar.
     """
+    return decode_qr_ladder(image_bytes, settings).content
+
+
+def decode_qr_ladder(image_bytes: bytes, settings, multi: bool = False) -> DecodeResult:
+    """
+    Пробует распознать код по ступеням — от дешёвых к дорогим — и
+    останавливается на первой удачной. Дорогие ступени пропускаются,
+    если на картинку уже потрачен лимит процессорного времени.
+
+    В режиме multi ступень не прерывается на первом коде: собираются все
+    разные коды со всех её вариантов вместе с рамками, в порядке чтения
+    (сверху вниз, слева направо). Следующая из MULTI_STAGES запускается,
+    только если find_qr_regions видит области, где код не прочитан; если
+    такие остались и после них, результат помечается incomplete.
+    """
+    started = time.process_time()
     try:
         # 1. Открываем изображение из байтов
         image = Image.open(io.BytesIO(image_bytes))
+        original_size = image.size
+
+        # 2. УСКОРЕНИЕ: большой JPEG сразу декодируем уменьшенным и в оттенках серого
+        _draft_jpeg(image, settings.decode_draft_side)
+
+        # Остальные форматы так не уменьшить, а PNG на 100 Мп займёт в памяти
+        # сотни мегабайт. Размер известен из заголовка — пиксели ещё не прочитаны.
+        if image.width * image.height > settings.decode_max_pixels:
+            logger.warning(f"Image {image.format} {image.width}x{image.height} exceeds decode_max_pixels")
+            return DecodeResult(None, None)
+
+        # 3. Переводим в черно-белый формат (так быстрее читается)
+        gray = image.convert('L')
+        draft_factor = (original_size[0] / gray.width, original_size[1] / gray.height)
+
+        # 4. Идём по ступеням
+        found: dict[str, QRCode] = {}
+        found_stage = None
+        regions = None  # кандидаты из find_qr_regions, считаются один раз и только при нужде
 
-        # 2. УСКОРЕНИЕ: Переводим в черно-белый формат (так быстрее читается)
-        image = image.convert('L')
+        def has_unread_regions() -> bool:
+            nonlocal regions
+            if len(found) >= settings.decode_max_codes or settings.decode_roi_regions <= 0:
+                return False
+            if regions is None:
+                regions = find_qr_regions(gray, settings.decode_roi_regions)
+            return _has_unread_regions(regions, found.values(), draft_factor)
 
-        # 3. Декодируем
-        decoded_objects = pyzbar.decode(image)
+        for stage, make_variants in _stages(gray, settings):
+            if found and not (multi and stage in MULTI_STAGES and has_unread_regions()):
+                break
+            if stage != "downscaled" and time.process_time() - started > settings.decode_cpu_budget:
+                logger.info(f"Decode budget exhausted before stage '{stage}'")
+                break
+            for variant, to_original in make_variants():
+                for content, rect in _decode_image(variant, multi):
+                    content = apply_length_limit(content, settings)
+                    if content not in found:
+                        box = to_original(rect) if to_original else None
+                        if box and gray.size != original_size:
+                            box = _scale_box(box, *draft_factor)
+                        found[content] = QRCode(content, box)
+                if found and not multi:
+                    break
+            if found and found_stage is None:
+                found_stage = stage
 
-        if not decoded_objects:
-            # QR-код не найден
-            return None
+        if found:
+            codes = sorted(found.values(), key=_reading_order)[:settings.decode_max_codes]
+            if not multi:
+                return DecodeResult(codes[0].content, found_stage)
+            return DecodeResult(codes[0].content, found_stage, tuple(codes), has_unread_regions())
 
-        # 4. Ищем именно QR-код
-        for obj in decoded_objects:
-            if obj.type == 'QRCODE':
-                content = obj.data.decode('utf-8')
-                return apply_length_limit(content, settings)
-        
-        return None
+        # QR-код не найден
+        return DecodeResult(None, None)
 
     except Exception as e:
         logger.error(f"Ошибка при чтении QR: {e}")
         # Возвращаем None, чтобы бот просто сказал "Не нашел код", а не пугал ошибками
-        return None
+        return DecodeResult(None, None)
+
+
+def decode_qr_batch(images: list[bytes], settings, multi: bool = False) -> list[DecodeResult]:
+    """Распознаёт несколько картинок за одну задачу пула (например, альбом)."""
+    return [decode_qr_ladder(image_bytes, settings, multi) for image_bytes in images]
+
+
+def _draft_jpeg(image: Image.Image, max_side: int):
+    """
+    Просит декодер JPEG уменьшить картинку в 2/4/8 раз прямо при распаковке
+    (так, чтобы длинная сторона осталась не меньше max_side) и сразу отдать
+    яркость. Снимок телефона 4000×3000 распаковывается вчетверо быстрее и
+    занимает в памяти в 12 раз меньше.
+    """
+    if image.format != "JPEG" or max(image.size) <= max_side:
+        return
+    factor = max_side / max(image.size)
+    image.draft('L', (math.ceil(image.width * factor), math.ceil(image.height * factor)))
+
+
+def _has_unread_regions(regions: list[tuple[int, int, int, int]], codes, draft_factor: tuple[float, float]) -> bool:
+    """Есть ли области-кандидаты (в координатах gray), в которые не попал центр ни одного кода."""
+    centers = []
+    for code in codes:
+        if code.box is not None:
+            left, top, width, height = code.box
+            centers.append(((left + width / 2) / draft_factor[0], (top + height / 2) / draft_factor[1]))
+    return any(
+        not any(left <= x <= right and top <= y <= bottom for x, y in centers)
+        for left, top, right, bottom in regions
+    )
+
+
+def _scale_box(box: Box, factor_x: float, factor_y: float) -> Box:
+    left, top, width, height = box
+    return (round(left * factor_x), round(top * factor_y), round(width * factor_x), round(height * factor_y))
+
+
+def _reading_order(code: QRCode) -> tuple:
+    if code.box is None:
+        return (1, 0, 0)
+    left, top, width, height = code.box
+    # Коды, чьи центры почти на одной высоте, считаем одной строкой
+    row = (top + height // 2) // max(height, 1)
+    return (0, row, left)
+
+
+def _scaled(factor_x: float, factor_y: float, offset_x: int = 0, offset_y: int = 0):
+    """Переводит рамку из координат варианта в координаты исходного кадра."""
+    def to_original(rect) -> Box:
+        return (
+            offset_x + round(rect.left * factor_x),
+            offset_y + round(rect.top * factor_y),
+            round(rect.width * factor_x),
+            round(rect.height * factor_y),
+        )
+    return to_original
+
+
+def _stages(gray: Image.Image, settings):
+    """
+    Ступени распознавания: (название, функция, возвращающая варианты картинки).
+    Вариант — пара (картинка, перевод рамки в координаты кадра или None).
+    """
+    same = _scaled(1, 1)
+    downscale_side = settings.decode_downscale_side
+    if max(gray.size) > downscale_side:
+        def downscaled():
+            small = gray.copy()
+            small.thumbnail((downscale_side, downscale_side), Image.Resampling.BILINEAR)
+            return [(small, _scaled(gray.width / small.width, gray.height / small.height))]
+        yield "downscaled", downscaled
+
+    if settings.decode_roi_regions > 0:
+        # Кропы вокруг найденных кандидатов; весь кадр остаётся следующей ступенью
+        def roi():
+            for box in find_qr_regions(gray, settings.decode_roi_regions):
+                crop = crop_region(gray, box)
+                factor_x = (box[2] - box[0]) / crop.width
+                factor_y = (box[3] - box[1]) / crop.height
+                yield crop, _scaled(factor_x, factor_y, box[0], box[1])
+        yield "roi", roi
+
+    yield "full", lambda: [(gray, same)]
+    yield "sharpen", lambda: [
+        (ImageOps.autocontrast(gray.filter(ImageFilter.UnsharpMask(radius=2, percent=150))), same)
+    ]
+    yield "threshold", lambda: [(_adaptive_threshold(gray), same)]
+    yield "rotate", lambda: (
+        (gray.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255), None)
+        for angle in ROTATION_ANGLES
+    )
+
+
+def _adaptive_threshold(gray: Image.Image, offset: int = 10) -> Image.Image:
+    """Бинаризация относительно локального среднего — помогает при неровном освещении."""
+    radius = max(8, max(gray.size) // 32)
+    local_mean = gray.filter(ImageFilter.BoxBlur(radius))
+    # Пиксель считаем тёмным, если он заметно темнее своей окрестности
+    darker = ImageChops.subtract(local_mean, gray)
+    return darker.point([0 if v > offset else 255 for v in range(256)])
+
+
+def _decode_image(image: Image.Image, multi: bool = False) -> list[tuple[str, object]]:
+    """Пары (текст, рамка pyzbar) для QR-кодов на картинке; без multi — не больше одной."""
+    decoded_objects = pyzbar.decode(image, symbols=[pyzbar.ZBarSymbol.QRCODE])
+
+    # Ищем именно QR-код
+    codes = []
+    for obj in decoded_objects:
+        if obj.type == 'QRCODE':
+            codes.append((obj.data.decode('utf-8'), obj.rect))
+            if not multi:
+                break
+    return codes
+
 
 def apply_length_limit(data: str, settings) -> str:
     """Обрезает слишком длинный текст."""
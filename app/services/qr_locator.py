@@ -0,0 +1,85 @@
+# app/services/qr_locator.py
+from PIL import Image, ImageFilter
+
+ANALYSIS_SIDE = 256   # до какого размера ужимаем кадр для поиска
+CELL = 8              # размер ячейки сетки на уменьшенной копии, px
+EDGE_THRESHOLD = 48   # перепад яркости, который считаем границей модуля
+DENSITY_THRESHOLD = 70  # доля "граничных" пикселей в ячейке (из 255)
+MIN_CELLS = 4
+MIN_CROP_SIDE = 600   # маленькие кропы увеличиваем, чтобы модули были крупнее
+
+
+def find_qr_regions(gray: Image.Image, max_regions: int = 3) -> list[tuple[int, int, int, int]]:
+    """
+    Дешёвый поиск областей, похожих на QR-код.
+
+    QR — это плотная россыпь чёрно-белых модулей, поэтому на уменьшенной копии
+    ищем скопления ячеек с большим количеством резких перепадов яркости.
+    Возвращает рамки (left, top, right, bottom) в координатах исходного кадра,
+    самые крупные — первыми.
+    """
+    small = gray.copy()
+    small.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE), Image.Resampling.BILINEAR)
+    grid_w, grid_h = small.width // CELL, small.height // CELL
+    if grid_w < 2 or grid_h < 2:
+        return []
+
+    edges = small.filter(ImageFilter.FIND_EDGES).point(
+        [255 if v > EDGE_THRESHOLD else 0 for v in range(256)]
+    )
+    # BOX-ресэмплинг усредняет каждую ячейку — получаем плотность границ одним вызовом
+    density = edges.crop((0, 0, grid_w * CELL, grid_h * CELL)).resize((grid_w, grid_h), Image.Resampling.BOX)
+    dense = [v > DENSITY_THRESHOLD for v in density.getdata()]
+
+    boxes = []
+    seen = [False] * len(dense)
+    for start, is_dense in enumerate(dense):
+        if not is_dense or seen[start]:
+            continue
+        # Обход связной области ячеек
+        seen[start] = True
+        stack = [start]
+        cells = 0
+        min_x = min_y = float("inf")
+        max_x = max_y = -1
+        while stack:
+            idx = stack.pop()
+            cells += 1
+            y, x = divmod(idx, grid_w)
+            min_x, max_x = min(min_x, x), max(max_x, x)
+            min_y, max_y = min(min_y, y), max(max_y, y)
+            for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                if 0 <= nx < grid_w and 0 <= ny < grid_h:
+                    n = ny * grid_w + nx
+                    if dense[n] and not seen[n]:
+                        seen[n] = True
+                        stack.append(n)
+
+        width, height = max_x - min_x + 1, max_y - min_y + 1
+        if cells < MIN_CELLS or not 0.33 <= width / height <= 3:
+            continue
+        boxes.append((cells, min_x, min_y, max_x + 1, max_y + 1))
+
+    boxes.sort(reverse=True)
+    scale_x = gray.width / small.width
+    scale_y = gray.height / small.height
+    regions = []
+    for _, left, top, right, bottom in boxes[:max_regions]:
+        # Запас в одну ячейку: тихая зона и края кода часто попадают в соседние ячейки
+        regions.append((
+            max(0, int((left - 1) * CELL * scale_x)),
+            max(0, int((top - 1) * CELL * scale_y)),
+            min(gray.width, int((right + 1) * CELL * scale_x)),
+            min(gray.height, int((bottom + 1) * CELL * scale_y)),
+        ))
+    return regions
+
+
+def crop_region(gray: Image.Image, box: tuple[int, int, int, int]) -> Image.Image:
+    """Вырезает область из полноразмерного кадра и при необходимости увеличивает её."""
+    crop = gray.crop(box)
+    side = max(crop.size)
+    if 0 < side < MIN_CROP_SIDE:
+        factor = MIN_CROP_SIDE / side
+        crop = crop.resize((round(crop.width * factor), round(crop.height * factor)), Image.Resampling.BICUBIC)
+    return crop
@@ -0,0 +1,111 @@
+# app/services/rate_limit.py
+import asyncio
+import logging
+import time
+from app.services.metrics import RATE_LIMITED
+from app.utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryRateLimitBackend:
+    """
+    Хранит по одному числу на активный ключ — TAT (theoretical arrival time) из GCRA.
+    Ключ, у которого TAT уже в прошлом, ничем не отличается от нового и может быть удалён.
+    """
+
+    def __init__(self):
+        self._tat: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    async def acquire(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        tat = max(self._tat.get(key, now), now)
+        if tat - now > tolerance:
+            return False
+        self._tat[key] = tat + interval
+        return True
+
+    async def evict_idle(self, now: float) -> int:
+        idle = [key for key, tat in self._tat.items() if tat <= now]
+        for key in idle:
+            del self._tat[key]
+        return len(idle)
+
+
+class SQLiteRateLimitBackend:
+    """
+    Тот же GCRA в общей таблице SQLite: лимиты делят все процессы бота.
+    Проверка и запись — один атомарный upsert, поэтому пишется сразу, без батчей:
+    иначе параллельные воркеры пропускали бы лишние запросы.
+    """
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        db.call(lambda conn: conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)"
+        ))
+
+    def __len__(self) -> int:
+        return self.db.call(lambda conn: conn.execute("SELECT count(*) FROM rate_limits").fetchone()[0])
+
+    @staticmethod
+    def _acquire(conn, key: str, now: float, interval: float, tolerance: float) -> bool:
+        # Обновление не проходит (rowcount 0), если бакет пуст
+        cursor = conn.execute(
+            "INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) "
+            "ON CONFLICT(key) DO UPDATE SET tat = max(tat, :now) + :interval "
+            "WHERE max(tat, :now) - :now <= :tolerance",
+            {"key": key, "now": now, "interval": interval, "tolerance": tolerance},
+        )
+        return cursor.rowcount > 0
+
+    async def acquire(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        return await self.db.run(self._acquire, key, now, interval, tolerance)
+
+    async def evict_idle(self, now: float) -> int:
+        return await self.db.run(lambda conn: conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,)).rowcount)
+
+
+class RateLimiter:
+    """
+    Лимитер по алгоритму GCRA (эквивалент token bucket): O(1) на проверку
+    и одна запись на пользователя. Бакет ёмкостью `limit` пополняется
+    равномерно за `window` секунд. Хранилище подменяемое — общий бэкенд
+    позволяет нескольким процессам бота делить одни лимиты.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else InMemoryRateLimitBackend()
+        self.rejected: dict[str, int] = {}
+        self._eviction_task: asyncio.Task | None = None
+
+    async def hit(self, action: str, user_id: int, limit: int, window: float) -> bool:
+        """Списывает одну операцию. False — лимит исчерпан."""
+        interval = window / limit
+        tolerance = window - interval
+        allowed = await self.backend.acquire(f"{action}:{user_id}", time.time(), interval, tolerance)
+        if not allowed:
+            self.rejected[action] = self.rejected.get(action, 0) + 1
+            RATE_LIMITED.inc(action=action)
+        return allowed
+
+    def start_eviction(self, interval: float):
+        if self._eviction_task is None:
+            self._eviction_task = asyncio.create_task(self._eviction_loop(interval))
+
+    async def _eviction_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.backend.evict_idle(time.time())
+                if evicted:
+                    logger.debug(f"Rate limiter evicted {evicted} idle users")
+            except Exception as e:
+                logger.error(f"Rate limiter eviction failed: {e}")
+
+    async def close(self):
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+            self._eviction_task = None
@@ -0,0 +1,72 @@
+# app/services/redirects.py
+import asyncio
+import logging
+from urllib.parse import urljoin
+from aiohttp import ClientSession, ClientTimeout
+from app.services.security import is_valid_url
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+# Сервер не умеет HEAD — повторяем через GET
+HEAD_UNSUPPORTED_STATUSES = {400, 403, 404, 405, 501}
+
+
+async def resolve_redirect_chain(url: str, session: ClientSession, settings, on_hop=None) -> list[str]:
+    """
+    Проходит по редиректам по одному шагу и возвращает всю цепочку
+    (первый элемент — исходная ссылка, последний — конечная).
+
+    Общий дедлайн на всю цепочку и лимит шагов; на каждом шаге сначала HEAD,
+    а если сервер его не поддерживает — GET без чтения тела. Для каждой
+    новой ссылки сразу вызывается on_hop(url), чтобы проверка безопасности
+    шла параллельно с дальнейшим резолвом.
+    """
+    chain = [url]
+    hop_timeout = ClientTimeout(total=settings.redirect_hop_timeout)
+    budget = asyncio.timeout(settings.redirect_deadline)
+    try:
+        async with budget:
+            current = url
+            for _ in range(settings.redirect_max_hops):
+                location = await _next_location(current, session, hop_timeout)
+                if not location:
+                    break
+                next_url = urljoin(current, location)
+                if not is_valid_url(next_url) or next_url in chain:
+                    # Редирект на не-http(s) или зацикливание
+                    break
+                chain.append(next_url)
+                if on_hop is not None:
+                    on_hop(next_url)
+                current = next_url
+            else:
+                logger.info(f"Redirect hop limit reached for {url[:50]}")
+    except TimeoutError:
+        if budget.expired():
+            logger.info(f"Redirect deadline exceeded for {url[:50]} after {len(chain) - 1} hops")
+        else:
+            logger.info(f"Redirect hop timed out for {url[:50]} after {len(chain) - 1} hops")
+    except Exception as e:
+        logger.info(f"Redirect resolution stopped for {url[:50]}: {e}")
+    return chain
+
+
+async def _next_location(url: str, session: ClientSession, timeout: ClientTimeout) -> str | None:
+    """Location следующего шага или None, если это конечная ссылка."""
+    try:
+        async with session.head(url, allow_redirects=False, timeout=timeout) as response:
+            if response.status in REDIRECT_STATUSES:
+                return response.headers.get("Location")
+            if response.status not in HEAD_UNSUPPORTED_STATUSES:
+                return None
+    except Exception as e:
+        # Таймаут или ошибка на HEAD — как 405: пробуем этот же шаг через GET.
+        # Общий дедлайн сюда не попадает: он отменяет задачу (CancelledError)
+        logger.debug(f"HEAD failed for {url[:50]} ({e!r}), retrying with GET")
+
+    # Тело не читаем: выходя из контекста, соединение просто освобождается
+    async with session.get(url, allow_redirects=False, timeout=timeout) as response:
+        if response.status in REDIRECT_STATUSES:
+            return response.headers.get("Location")
+        return None
@@ -1,35 +1,49 @@
 # app/services/security.py
 import asyncio
 import logging
-import time
-from collections import defaultdict
 from urllib.parse import urlparse
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientSession
+from app.services.gsb_batcher import SafeBrowsingBatcher
+from app.services.metrics import CACHE_LOOKUPS, SINGLEFLIGHT_CALLS, observe_stage
+from app.services.rate_limit import RateLimiter
+from app.services.threat_lists import ThreatListDatabase
+from app.utils.cache import SQLiteCacheStore, TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.urls import normalize_url
 # from app.config import settings # <-- УБРАНО
 
 logger = logging.getLogger(__name__)
 
-# In-memory cache for URL safety checks
-url_safety_cache = {}
+# In-memory cache for URL safety checks (limits and disk tier are set in setup_url_cache)
 CACHE_TTL = 3600  # 1 hour cache
+url_safety_cache = TTLCache(max_items=10_000, ttl=CACHE_TTL)
+_cache_load_task: asyncio.Task | None = None
 
-# Rate limiting storage
-user_requests = defaultdict(list)
+# Safe Browsing batcher, bound to the shared HTTP session
+_batcher: SafeBrowsingBatcher | None = None
 
-def is_rate_limited(user_id: int, settings) -> bool:
-    """Check if user is rate limited. settings передается как аргумент."""
-    current_time = time.time()
-    user_requests[user_id] = [
-        req_time for req_time in user_requests[user_id]
-        if current_time - req_time < settings.rate_limit_window
-    ]
+# Local hash-prefix database (Update API), enabled by GSB_LOCAL_LISTS
+threat_db: ThreatListDatabase | None = None
 
-    if len(user_requests[user_id]) >= settings.rate_limit_requests:
-        logger.info(f"User {user_id} is rate limited.")
-        return True
+# Concurrent checks of the same URL share one in-flight lookup
+safety_flight = SingleFlight("url_safety", SINGLEFLIGHT_CALLS)
 
-    user_requests[user_id].append(current_time)
-    return False
+# Rate limiting: one GCRA record per active user and action
+rate_limiter = RateLimiter()
+
+def _rate_limit_for(action: str, settings) -> int:
+    return {
+        "scan": settings.rate_limit_requests,
+        "qr": settings.rate_limit_qr_requests,
+        "url": settings.rate_limit_url_requests,
+    }[action]
+
+async def is_rate_limited(user_id: int, settings, action: str = "scan") -> bool:
+    """Check if user is rate limited for an action (scan, qr, url). settings передается как аргумент."""
+    allowed = await rate_limiter.hit(action, user_id, _rate_limit_for(action, settings), settings.rate_limit_window)
+    if not allowed:
+        logger.info(f"User {user_id} is rate limited ({action}).")
+    return not allowed
 
 def is_valid_url(url: str) -> bool:
     """Validate URL format."""
@@ -39,12 +53,59 @@ def is_valid_url(url: str) -> bool:
     except Exception:
         return False
 
-async def check_url_safety(url: str, settings) -> tuple[bool | None, str | None]:
+async def setup_url_cache(settings, state=None):
+    """
+    Применяет лимиты из настроек и подключает дисковый слой кэша: свой файл
+    URL_CACHE_DB_PATH или общий бэкенд состояния, если он его даёт.
+    """
+    url_safety_cache.max_items = settings.url_cache_max_items
+    url_safety_cache.max_bytes = settings.url_cache_max_bytes
+    url_safety_cache.ttl = settings.url_cache_ttl_safe
+    if url_safety_cache.store is not None:
+        return
+    if settings.url_cache_db_path:
+        url_safety_cache.store = await asyncio.to_thread(SQLiteCacheStore, settings.url_cache_db_path, "url_safety")
+    elif state is not None:
+        url_safety_cache.store = await asyncio.to_thread(state.cache_store, "url_safety")
+    if url_safety_cache.store is not None:
+        # Загрузка идёт в фоне: бот стартует сразу, кэш догревается сам
+        global _cache_load_task
+        _cache_load_task = asyncio.create_task(url_safety_cache.load())
+        url_safety_cache.start_flusher(settings.url_cache_flush_interval)
+
+async def close_url_cache():
+    await url_safety_cache.close()
+
+async def start_threat_lists(settings, session: ClientSession):
+    """Запускает фоновую синхронизацию локальных списков угроз, если она включена."""
+    global threat_db
+    if settings.gsb_local_lists and settings.gsb_api_key and threat_db is None:
+        threat_db = ThreatListDatabase(settings)
+        threat_db.start(session)
+
+async def stop_threat_lists():
+    global threat_db
+    if threat_db is not None:
+        await threat_db.stop()
+        threat_db = None
+
+def _get_batcher(settings, session: ClientSession) -> SafeBrowsingBatcher:
+    """Один батчер на HTTP-сессию: после перезапуска бота создаётся заново."""
+    global _batcher
+    if _batcher is None or _batcher.session is not session:
+        _batcher = SafeBrowsingBatcher(session, settings)
+    return _batcher
+
+async def check_url_safety(url: str, settings, session: ClientSession) -> tuple[bool | None, str | None]:
     """
     Check URL safety using Google Safe Browsing API with caching.
     Returns: (is_safe: bool, threat_type: str or None)
-    settings передается как аргумент.
+    settings и общая HTTP-сессия передаются как аргументы.
     """
+    with observe_stage("check_url_safety"):
+        return await _check_url_safety(url, settings, session)
+
+async def _check_url_safety(url: str, settings, session: ClientSession) -> tuple[bool | None, str | None]:
     if not settings.gsb_api_key:
         logger.warning("GSB_API_KEY not configured, skipping safety check.")
         return (None, "API key not configured")
@@ -53,57 +114,26 @@ async def check_url_safety(url: str, settings) -> tuple[bool | None, str | None]
         return (None, "Invalid URL format")
 
     # Check cache first
-    current_time = time.time()
-    if url in url_safety_cache:
-        cached_result, cache_time = url_safety_cache[url]
-        if current_time - cache_time < CACHE_TTL:
-            logger.info(f"Using cached result for URL: {url[:50]}...")
-            return cached_result
-
-    api_url = f"https://safebrowsing.googleapis.com/v4/threatMatches:find?key={settings.gsb_api_key}"
-
-    payload = {
-        "client": {
-            "clientId": "qrscanerpro",
-            "clientVersion": "2.0.0"
-        },
-        "threatInfo": {
-            "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
-            "platformTypes": ["ANY_PLATFORM"],
-            "threatEntryTypes": ["URL"],
-            "threatEntries": [{"url": url}]
-        }
-    }
-
-    timeout = ClientTimeout(total=settings.request_timeout)
-    try:
-        async with ClientSession(timeout=timeout) as session:
-            async with session.post(api_url, json=payload) as resp:
-                if resp.status != 200:
-                    logger.warning(f"Safe Browsing API returned status {resp.status}")
-                    return (None, f"API error: {resp.status}")
-
-                result = await resp.json()
-
-                if 'matches' in result and len(result['matches']) > 0:
-                    threat = result['matches'][0].get('threatType', 'UNKNOWN')
-                    result_tuple = (False, threat)
-                else:
-                    result_tuple = (True, None)
-
-                # Cache the result
-                url_safety_cache[url] = (result_tuple, current_time)
-                # Simple cache cleanup
-                if len(url_safety_cache) > 1000:
-                    old_entries = [k for k, (_, t) in url_safety_cache.items() if current_time - t > CACHE_TTL]
-                    for k in old_entries:
-                        del url_safety_cache[k]
-
-                return result_tuple
-
-    except asyncio.TimeoutError:
-        logger.warning("Safe Browsing API request timed out")
-        return (None, "Request timeout")
-    except Exception as e:
-        logger.error(f"Error checking URL safety: {e}")
-        return (None, "API error")
+    key = normalize_url(url)
+    cached_result = await url_safety_cache.fetch(key)
+    CACHE_LOOKUPS.inc(cache="url_safety", result="miss" if cached_result is None else "hit")
+    if cached_result is not None:
+        logger.info(f"Using cached result for URL: {url[:50]}...")
+        # С диска кортеж возвращается списком
+        return tuple(cached_result)
+
+    return await safety_flight.do(key, _lookup_and_cache, key, url, settings, session)
+
+async def _lookup_and_cache(key: str, url: str, settings, session: ClientSession) -> tuple[bool | None, str | None]:
+    if threat_db is not None and threat_db.ready:
+        # Локальная проверка; в сеть идём, только если совпал хэш-префикс
+        result_tuple = await threat_db.lookup(url, session)
+    else:
+        result_tuple = await _get_batcher(settings, session).check(url)
+    if result_tuple[0] is None:
+        # Ошибки не кэшируем — в следующий раз попробуем снова
+        return result_tuple
+
+    ttl = settings.url_cache_ttl_safe if result_tuple[0] else settings.url_cache_ttl_unsafe
+    url_safety_cache.set(key, result_tuple, ttl=ttl)
+    return result_tuple
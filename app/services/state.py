@@ -0,0 +1,76 @@
+# app/services/state.py
+"""
+Где живёт состояние бота: лимиты, кэш проверок ссылок, счётчики сканов
+и FSM-диалоги. Бэкенд выбирается настройкой STATE_BACKEND:
+
+- memory — всё в памяти процесса (как раньше), годится для одного воркера;
+- sqlite — общий файл SQLite в режиме WAL, его делят несколько процессов
+  на одной машине. Лимиты и FSM пишутся сразу, кэш и счётчики — пачками.
+"""
+import logging
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from app.services.fsm_storage import SQLiteStorage
+from app.services.rate_limit import InMemoryRateLimitBackend, SQLiteRateLimitBackend
+from app.services.stats_store import SQLiteCounterStore
+from app.utils.cache import SQLiteCacheStore
+from app.utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStateBackend:
+    """Состояние в памяти процесса. Кэш и счётчики остаются локальными (None)."""
+
+    name = "memory"
+
+    def rate_limit_backend(self):
+        return InMemoryRateLimitBackend()
+
+    def cache_store(self, table: str) -> SQLiteCacheStore | None:
+        return None
+
+    def counters(self) -> SQLiteCounterStore | None:
+        # StatsStore сам сохраняет счётчики в stats.txt
+        return None
+
+    def fsm_storage(self) -> BaseStorage:
+        return MemoryStorage()
+
+    async def close(self):
+        pass
+
+
+class SQLiteStateBackend:
+    """Общий файл SQLite (WAL): одно соединение на процесс для лимитов, счётчиков и FSM."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = SQLiteDatabase(path)
+
+    def rate_limit_backend(self):
+        return SQLiteRateLimitBackend(self.db)
+
+    def cache_store(self, table: str) -> SQLiteCacheStore | None:
+        # Записи кэша сбрасываются пачками фоновым flush'ем TTLCache
+        return SQLiteCacheStore(self.path, table)
+
+    def counters(self) -> SQLiteCounterStore | None:
+        return SQLiteCounterStore(self.db)
+
+    def fsm_storage(self) -> BaseStorage:
+        return SQLiteStorage(self.db)
+
+    async def close(self):
+        self.db.close()
+
+
+def create_state_backend(settings) -> MemoryStateBackend | SQLiteStateBackend:
+    if settings.state_backend == "sqlite":
+        logger.info(f"Shared state in {settings.state_db_path}")
+        return SQLiteStateBackend(settings.state_db_path)
+    if settings.state_backend != "memory":
+        raise ValueError(f"Unknown STATE_BACKEND: {settings.state_backend}")
+    return MemoryStateBackend()
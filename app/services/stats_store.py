@@ -0,0 +1,237 @@
+# app/services/stats_store.py
+import asyncio
+import logging
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from app.utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 90  # сколько дней разбивки храним в файле
+
+
+class SQLiteCounterStore:
+    """Общие счётчики в SQLite: имя -> число. Приращения приходят пачками."""
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+        db.call(lambda conn: conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        ))
+
+    @staticmethod
+    def _add(conn, deltas: dict[str, int]):
+        conn.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            deltas.items(),
+        )
+
+    async def add(self, deltas: dict[str, int]):
+        await self.db.run(self._add, deltas)
+
+    async def totals(self) -> dict[str, int]:
+        rows = await self.db.run(lambda conn: conn.execute("SELECT name, value FROM counters").fetchall())
+        return dict(rows)
+
+    async def delete_before(self, prefix: str, cutoff: str) -> int:
+        """Удаляет счётчики prefix* с суффиксом меньше cutoff (старые дни)."""
+        return await self.db.run(lambda conn: conn.execute(
+            "DELETE FROM counters WHERE name >= ? AND name < ?", (prefix, prefix + cutoff)
+        ).rowcount)
+
+
+class StatsStore:
+    """
+    Счётчики сканов, которые переживают перезапуск.
+
+    Читается из stats.txt при старте, в памяти просто увеличивает числа
+    (всё происходит в одном event loop, блокировки не нужны), а на диск
+    пишется периодически и при остановке — атомарно и в отдельном потоке.
+    Дата «сегодня» переключается фоновой задачей в полночь, а не проверяется
+    на каждом скане.
+
+    С общим хранилищем counters (SQLiteCounterStore) файл не используется:
+    приращения копятся в памяти и уходят одной транзакцией при сбросе,
+    а взамен приходят суммы по всем процессам.
+    """
+
+    def __init__(self, path: str, counters: SQLiteCounterStore | None = None):
+        self.path = path
+        self.counters = counters
+        self.total_scans = 0
+        self.total_codes = 0
+        self.today = date.today()
+        self.by_type: dict[str, int] = {}
+        self.by_day: dict[str, int] = {}
+        self._today_key = self.today.isoformat()
+        self._dirty = False
+        self._pending: dict[str, int] = {}  # приращения, ещё не отправленные в counters
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def today_scans(self) -> int:
+        return self.by_day.get(self._today_key, 0)
+
+    def record_scan(self, qr_types: list[str]):
+        """Один скан — одна картинка; by_type и total_codes считают коды на ней."""
+        self.total_scans += 1
+        self.total_codes += len(qr_types)
+        self.by_day[self._today_key] = self.by_day.get(self._today_key, 0) + 1
+        for qr_type in qr_types:
+            self.by_type[qr_type] = self.by_type.get(qr_type, 0) + 1
+        self._dirty = True
+        if self.counters is not None:
+            names = ["total_scans", f"day.{self._today_key}"] + ["total_codes"] * len(qr_types)
+            names += [f"type.{qr_type}" for qr_type in qr_types]
+            for name in names:
+                self._pending[name] = self._pending.get(name, 0) + 1
+
+    def recent_days(self, days: int = 7) -> list[tuple[str, int]]:
+        keys = [(self.today - timedelta(days=i)).isoformat() for i in range(days)]
+        return [(key, self.by_day.get(key, 0)) for key in keys]
+
+    # --- Файл ---
+
+    async def load(self):
+        if self.counters is not None:
+            await self._sync()
+            logger.info(f"Stats loaded: {self.total_scans} scans total")
+            return
+        if not os.path.exists(self.path):
+            return
+        try:
+            text = await asyncio.to_thread(self._read)
+        except OSError as e:
+            logger.error(f"Не удалось прочитать {self.path}: {e}")
+            return
+        self._parse(text)
+        logger.info(f"Stats loaded: {self.total_scans} scans total")
+
+    def _read(self) -> str:
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+    def _parse(self, text: str):
+        values = {}
+        for line in text.splitlines():
+            key, sep, value = line.partition(":")
+            if sep:
+                values[key.strip()] = value.strip()
+
+        def as_int(value: str) -> int:
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+
+        self._apply({key: as_int(value) for key, value in values.items()})
+
+        # Старый формат: только today_scans + last_reset
+        last_reset = values.get("last_reset")
+        if last_reset and f"day.{last_reset}" not in values:
+            self.by_day[last_reset] = as_int(values.get("today_scans", "0"))
+
+    def _apply(self, values: dict[str, int]):
+        self.total_scans = values.get("total_scans", 0)
+        self.total_codes = values.get("total_codes", 0)  # в старых файлах его нет
+        for key, value in values.items():
+            if key.startswith("type."):
+                self.by_type[key[5:]] = value
+            elif key.startswith("day."):
+                self.by_day[key[4:]] = value
+
+    def _render(self) -> str:
+        cutoff = (self.today - timedelta(days=HISTORY_DAYS)).isoformat()
+        lines = [
+            f"total_scans: {self.total_scans}",
+            f"total_codes: {self.total_codes}",
+            f"today_scans: {self.today_scans}",
+            f"last_reset: {self._today_key}",
+        ]
+        lines += [f"type.{name}: {count}" for name, count in sorted(self.by_type.items())]
+        lines += [f"day.{day}: {count}" for day, count in sorted(self.by_day.items()) if day >= cutoff]
+        return "\n".join(lines) + "\n"
+
+    def _write(self, text: str):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".stats-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            # Атомарная замена: файл либо старый, либо новый целиком
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _sync(self):
+        """Отправляет накопленные приращения и забирает общие суммы."""
+        batch, self._pending = self._pending, {}
+        try:
+            if batch:
+                await self.counters.add(batch)
+            totals = await self.counters.totals()
+        except Exception as e:
+            for name, delta in batch.items():
+                self._pending[name] = self._pending.get(name, 0) + delta
+            logger.error(f"Не удалось синхронизировать статистику: {e}")
+            return
+        # Свои ещё не отправленные сканы (пришли, пока ждали базу) — поверх общих сумм
+        for name, delta in self._pending.items():
+            totals[name] = totals.get(name, 0) + delta
+        self._apply(totals)
+        self._dirty = False
+
+    async def flush(self):
+        if self.counters is not None:
+            # Суммы меняют и другие процессы — синхронизируемся всегда
+            await self._sync()
+            return
+        if not self._dirty:
+            return
+        # Снимок делаем в event loop, а пишем в отдельном потоке
+        text = self._render()
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, text)
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"Не удалось сохранить статистику: {e}")
+
+    # --- Фоновые задачи ---
+
+    def start(self, flush_interval: float):
+        self._tasks = [
+            asyncio.create_task(self._flush_loop(flush_interval)),
+            asyncio.create_task(self._midnight_loop()),
+        ]
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def _midnight_loop(self):
+        while True:
+            now = datetime.now()
+            tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            await asyncio.sleep((tomorrow - now).total_seconds() + 1)
+            self.today = date.today()
+            self._today_key = self.today.isoformat()
+            self._dirty = True
+            if self.counters is not None:
+                cutoff = (self.today - timedelta(days=HISTORY_DAYS)).isoformat()
+                try:
+                    await self.counters.delete_before("day.", cutoff)
+                except Exception as e:
+                    logger.error(f"Не удалось удалить старые дни статистики: {e}")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
@@ -0,0 +1,387 @@
+# app/services/threat_lists.py
+"""
+Локальная база хэш-префиксов Safe Browsing (v4 Update API).
+
+В фоне скачиваем списки угроз в виде 4–32-байтных префиксов SHA-256,
+а ссылку проверяем локально: считаем хэши её выражений (host/path) и
+ищем префиксы двоичным поиском. В сеть (fullHashes:find) идём только
+когда префикс совпал — для подавляющего большинства ссылок этого не нужно.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import posixpath
+import re
+import time
+from urllib.parse import quote, unquote, urlsplit
+from aiohttp import ClientSession, ClientTimeout
+from app.services.metrics import SAFE_BROWSING_REQUESTS, THREAT_LIST_LOCAL_VERDICTS
+
+logger = logging.getLogger(__name__)
+
+CLIENT_INFO = {"clientId": "qrscanerpro", "clientVersion": "2.0.0"}
+
+THREAT_LISTS = [
+    ("MALWARE", "ANY_PLATFORM", "URL"),
+    ("SOCIAL_ENGINEERING", "ANY_PLATFORM", "URL"),
+    ("UNWANTED_SOFTWARE", "ANY_PLATFORM", "URL"),
+    ("POTENTIALLY_HARMFUL_APPLICATION", "ANY_PLATFORM", "URL"),
+]
+
+
+# === Канонизация ссылок и выражения для хэшей ===
+
+def _unescape_fully(value: str) -> str:
+    # Снимаем %-экранирование, пока строка меняется
+    for _ in range(10):
+        unescaped = unquote(value)
+        if unescaped == value:
+            break
+        value = unescaped
+    return value
+
+
+def _escape(value: str) -> str:
+    # Экранируем управляющие символы, пробел, не-ASCII, '#' и '%' — как требует спецификация
+    return quote(value, safe="".join(chr(c) for c in range(33, 127) if chr(c) not in "#%"))
+
+
+def canonicalize_url(url: str) -> str | None:
+    """Упрощённая канонизация по правилам Safe Browsing v4. None — если ссылку не разобрать."""
+    url = re.sub(r"[\t\r\n]", "", url.strip())
+    url = url.split("#", 1)[0]
+    if "://" not in url:
+        url = "http://" + url
+
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+
+    host = _unescape_fully(host).strip(".").lower()
+    host = re.sub(r"\.{2,}", ".", host)
+    if not host:
+        return None
+
+    path = _unescape_fully(parts.path) or "/"
+    normalized = posixpath.normpath(re.sub(r"/{2,}", "/", path))
+    if path.endswith("/") and normalized != "/":
+        normalized += "/"
+    path = normalized if normalized.startswith("/") else "/" + normalized
+
+    result = f"{parts.scheme.lower()}://{_escape(host)}{_escape(path)}"
+    if "?" in url:
+        result += "?" + _escape(_unescape_fully(parts.query))
+    return result
+
+
+def _is_ip(host: str) -> bool:
+    return bool(re.fullmatch(r"[\d.]+", host)) or host.startswith("[")
+
+
+def url_expressions(canonical_url: str) -> list[str]:
+    """
+    Комбинации host-suffix/path-prefix, которые проверяются по спецификации:
+    до 5 вариантов хоста × до 6 вариантов пути.
+    """
+    rest = canonical_url.split("://", 1)[1]
+    host, _, path_query = rest.partition("/")
+    path_query = "/" + path_query
+    path, has_query, query = path_query.partition("?")
+
+    hosts = [host]
+    if not _is_ip(host):
+        labels = host.split(".")
+        # Последние 5 компонент и дальше, отбрасывая по одной, но не короче двух
+        for i in range(max(1, len(labels) - 5), len(labels) - 1):
+            suffix = ".".join(labels[i:])
+            if suffix != host:
+                hosts.append(suffix)
+
+    paths = []
+    if has_query:
+        paths.append(f"{path}?{query}")
+    paths.append(path)
+    segments = [s for s in path.split("/")[1:-1] if s]
+    prefix = "/"
+    paths.append(prefix)
+    for segment in segments[:3]:
+        prefix += segment + "/"
+        paths.append(prefix)
+
+    expressions = []
+    for h in hosts:
+        for p in dict.fromkeys(paths):
+            expressions.append(h + p)
+    return expressions
+
+
+def url_hashes(url: str) -> list[bytes]:
+    canonical = canonicalize_url(url)
+    if canonical is None:
+        return []
+    return [hashlib.sha256(expr.encode("utf-8")).digest() for expr in url_expressions(canonical)]
+
+
+# === Компактное хранилище префиксов ===
+
+class PrefixSet:
+    """
+    Отсортированные префиксы, сгруппированные по длине: для каждой длины —
+    один bytes-блоб. Память — ровно n*длина байт, поиск — двоичный.
+    """
+
+    def __init__(self, prefixes: list[bytes] | None = None):
+        self._blobs: dict[int, bytes] = {}
+        if prefixes:
+            by_length: dict[int, list[bytes]] = {}
+            for prefix in prefixes:
+                by_length.setdefault(len(prefix), []).append(prefix)
+            self._blobs = {length: b"".join(sorted(items)) for length, items in by_length.items()}
+
+    def __len__(self) -> int:
+        return sum(len(blob) // length for length, blob in self._blobs.items())
+
+    def sorted_prefixes(self) -> list[bytes]:
+        """Все префиксы в лексикографическом порядке — в нём API нумерует удаления."""
+        items = []
+        for length, blob in self._blobs.items():
+            items.extend(blob[i:i + length] for i in range(0, len(blob), length))
+        items.sort()
+        return items
+
+    def match(self, full_hash: bytes) -> bytes | None:
+        """Возвращает совпавший префикс или None."""
+        for length, blob in self._blobs.items():
+            needle = full_hash[:length]
+            lo, hi = 0, len(blob) // length
+            while lo < hi:
+                mid = (lo + hi) // 2
+                item = blob[mid * length:(mid + 1) * length]
+                if item < needle:
+                    lo = mid + 1
+                elif item > needle:
+                    hi = mid
+                else:
+                    return needle
+        return None
+
+
+class ThreatList:
+    def __init__(self, threat_type: str, platform_type: str, entry_type: str):
+        self.threat_type = threat_type
+        self.platform_type = platform_type
+        self.entry_type = entry_type
+        self.state = ""
+        self.prefixes = PrefixSet()
+        # Список получен целиком и сумма сошлась; после сброса — False до полного обновления
+        self.valid = False
+
+    @property
+    def ready(self) -> bool:
+        # Пустой список Safe Browsing не отдаёт: пустой = ещё не загружен или сброшен
+        return self.valid and len(self.prefixes) > 0
+
+    def descriptor(self) -> dict:
+        return {"threatType": self.threat_type, "platformType": self.platform_type, "threatEntryType": self.entry_type}
+
+    def apply_update(self, update: dict) -> bool:
+        """
+        Применяет ответ threatListUpdates:fetch. Возвращает False, если
+        контрольная сумма не сошлась (список сбрасывается до полного обновления).
+        Тяжёлая работа, вызывается в отдельном потоке.
+        """
+        if update.get("responseType") == "FULL_UPDATE":
+            current = []
+        else:
+            current = self.prefixes.sorted_prefixes()
+
+        removed = set()
+        for removal in update.get("removals", []):
+            removed.update(removal.get("rawIndices", {}).get("indices", []))
+        if removed:
+            current = [p for i, p in enumerate(current) if i not in removed]
+
+        for addition in update.get("additions", []):
+            raw = addition.get("rawHashes", {})
+            size = raw.get("prefixSize", 4)
+            data = base64.b64decode(raw.get("rawHashes", ""))
+            current.extend(data[i:i + size] for i in range(0, len(data), size))
+
+        current.sort()
+        expected = update.get("checksum", {}).get("sha256")
+        if expected and hashlib.sha256(b"".join(current)).digest() != base64.b64decode(expected):
+            logger.warning(f"Checksum mismatch for {self.threat_type}, resetting list")
+            self.state = ""
+            self.prefixes = PrefixSet()
+            self.valid = False
+            return False
+
+        self.prefixes = PrefixSet(current)
+        self.state = update.get("newClientState", "")
+        self.valid = True
+        return True
+
+
+def _parse_duration(value: str | None, default: float) -> float:
+    if not value:
+        return default
+    try:
+        return float(value.rstrip("s"))
+    except ValueError:
+        return default
+
+
+class ThreatListDatabase:
+    """Списки угроз + кэш полных хэшей + фоновая синхронизация."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lists = [ThreatList(*descriptor) for descriptor in THREAT_LISTS]
+        self._full_hashes: dict[bytes, tuple[str, float]] = {}  # full hash -> (threat, expires_at)
+        self._negative: dict[bytes, float] = {}  # prefix -> expires_at
+        self._sync_task: asyncio.Task | None = None
+        self.last_sync: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        """
+        Локальным вердиктам можно верить, только когда все списки загружены.
+        Иначе «префикса нет» значит «списка нет», и проверки идут в Lookup API.
+        """
+        return self.last_sync is not None and all(lst.ready for lst in self.lists)
+
+    def _api_url(self, method: str) -> str:
+        return f"{self.settings.gsb_api_url}/{method}?key={self.settings.gsb_api_key}"
+
+    # --- Синхронизация ---
+
+    def start(self, session: ClientSession):
+        if self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop(session))
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+
+    async def _sync_loop(self, session: ClientSession):
+        while True:
+            try:
+                wait = await self.sync(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Threat list sync failed: {e}")
+                wait = 60
+            # Сброшенный список догружаем, не дожидаясь планового обновления
+            interval = self.settings.gsb_update_interval if self.ready else 60
+            await asyncio.sleep(max(wait, interval))
+
+    async def sync(self, session: ClientSession) -> float:
+        """Одно обновление всех списков. Возвращает minimumWaitDuration в секундах."""
+        payload = {
+            "client": CLIENT_INFO,
+            "listUpdateRequests": [
+                {**lst.descriptor(), "state": lst.state, "constraints": {"supportedCompressions": ["RAW"]}}
+                for lst in self.lists
+            ],
+        }
+        timeout = ClientTimeout(total=self.settings.request_timeout)
+        async with session.post(self._api_url("threatListUpdates:fetch"), json=payload, timeout=timeout) as resp:
+            resp.raise_for_status()
+            result = await resp.json()
+
+        by_descriptor = {(l.threat_type, l.platform_type, l.entry_type): l for l in self.lists}
+        for update in result.get("listUpdateResponses", []):
+            lst = by_descriptor.get((update.get("threatType"), update.get("platformType"), update.get("threatEntryType")))
+            if lst is not None:
+                # Сортировка и проверка суммы для больших списков — не в event loop
+                await asyncio.to_thread(lst.apply_update, update)
+
+        self.last_sync = time.time()
+        logger.info(f"Threat lists synced: {sum(len(l.prefixes) for l in self.lists)} prefixes")
+        not_ready = [lst.threat_type for lst in self.lists if not lst.ready]
+        if not_ready:
+            logger.warning(f"Threat lists not usable yet ({', '.join(not_ready)}), using Lookup API")
+        return _parse_duration(result.get("minimumWaitDuration"), 0)
+
+    # --- Проверка ссылок ---
+
+    async def lookup(self, url: str, session: ClientSession) -> tuple[bool | None, str | None]:
+        now = time.time()
+        hashes = url_hashes(url)
+        pending_prefixes = set()
+
+        for full_hash in hashes:
+            cached = self._full_hashes.get(full_hash)
+            if cached and cached[1] > now:
+                return (False, cached[0])
+            # Истёкшее положительное совпадение перепроверяем даже при живом негативном кэше
+            positive_expired = cached is not None
+            for lst in self.lists:
+                prefix = lst.prefixes.match(full_hash)
+                if prefix is not None and (positive_expired or self._negative.get(prefix, 0) <= now):
+                    pending_prefixes.add(prefix)
+
+        if not pending_prefixes:
+            THREAT_LIST_LOCAL_VERDICTS.inc()
+            return (True, None)
+
+        try:
+            matches = await self._find_full_hashes(sorted(pending_prefixes), session)
+        except asyncio.TimeoutError:
+            logger.warning("Safe Browsing fullHashes request timed out")
+            return (None, "Request timeout")
+        except Exception as e:
+            logger.error(f"Error checking full hashes: {e}")
+            return (None, "API error")
+
+        for full_hash in hashes:
+            if full_hash in matches:
+                return (False, matches[full_hash])
+        return (True, None)
+
+    async def _find_full_hashes(self, prefixes: list[bytes], session: ClientSession) -> dict[bytes, str]:
+        SAFE_BROWSING_REQUESTS.inc(method="fullHashes:find")
+        payload = {
+            "client": CLIENT_INFO,
+            "clientStates": [lst.state for lst in self.lists],
+            "threatInfo": {
+                "threatTypes": sorted({l.threat_type for l in self.lists}),
+                "platformTypes": sorted({l.platform_type for l in self.lists}),
+                "threatEntryTypes": sorted({l.entry_type for l in self.lists}),
+                "threatEntries": [{"hash": base64.b64encode(p).decode()} for p in prefixes],
+            },
+        }
+        timeout = ClientTimeout(total=self.settings.request_timeout)
+        async with session.post(self._api_url("fullHashes:find"), json=payload, timeout=timeout) as resp:
+            resp.raise_for_status()
+            result = await resp.json()
+
+        now = time.time()
+        negative_until = now + _parse_duration(result.get("negativeCacheDuration"), 300)
+        for prefix in prefixes:
+            self._negative[prefix] = negative_until
+
+        matches = {}
+        for match in result.get("matches", []):
+            full_hash = base64.b64decode(match.get("threat", {}).get("hash", ""))
+            threat = match.get("threatType", "UNKNOWN")
+            matches[full_hash] = threat
+            self._full_hashes[full_hash] = (threat, now + _parse_duration(match.get("cacheDuration"), 300))
+
+        # Кэши маленькие, но чистим, чтобы не росли бесконечно
+        if len(self._negative) > 10_000:
+            self._negative = {p: t for p, t in self._negative.items() if t > now}
+        if len(self._full_hashes) > 10_000:
+            self._full_hashes = {h: v for h, v in self._full_hashes.items() if v[1] > now}
+        return matches
@@ -0,0 +1,57 @@
+# app/services/tracing.py
+"""
+Трассировка одного апдейта: из каких этапов сложилось его время.
+
+Трасса живёт в contextvar: задачи, созданные внутри хэндлера (проверки
+ссылок, резолв редиректов), наследуют контекст и пишут спаны в ту же
+трассу. Этапы конвейера попадают сюда через metrics.observe_stage.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+
+class Span(NamedTuple):
+    name: str
+    offset: float  # секунды от начала апдейта
+    duration: float
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: list[Span] = []
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def add(self, name: str, started: float, duration: float):
+        self.spans.append(Span(name, started - self.started, duration))
+
+    def breakdown(self) -> str:
+        """Спаны в порядке начала: «download 0.412s @0.051s, decode …»."""
+        spans = sorted(self.spans, key=lambda span: span.offset)
+        return ", ".join(f"{span.name} {span.duration:.3f}s @{span.offset:.3f}s" for span in spans) or "no spans"
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+def record_span(name: str, started: float, duration: float):
+    """Добавляет спан в трассу текущего апдейта (если она есть)."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+
+@contextmanager
+def span(name: str):
+    """Спан без метрики — для ожиданий и прочего, что не нужно в /metrics."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.perf_counter() - started)
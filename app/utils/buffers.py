@@ -0,0 +1,47 @@
+# app/utils/buffers.py
+
+
+class FileTooLarge(Exception):
+    """Файл больше разрешённого размера."""
+
+
+class PreallocatedBuffer:
+    """
+    Приёмник для потокового скачивания: пишет чанки в заранее выделенный
+    bytearray нужного размера. В отличие от BytesIO, итоговые байты
+    отдаются без копирования, а запись сверх max_size сразу обрывает загрузку.
+    """
+
+    def __init__(self, size_hint: int | None = None, max_size: int | None = None):
+        self.max_size = max_size
+        capacity = size_hint or 0
+        if max_size is not None:
+            capacity = min(capacity, max_size)
+        self._buffer = bytearray(capacity)
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def write(self, chunk: bytes) -> int:
+        end = self._length + len(chunk)
+        if self.max_size is not None and end > self.max_size:
+            raise FileTooLarge(f"File exceeds {self.max_size} bytes")
+        if end > len(self._buffer):
+            # Размер не знали заранее (или он оказался неверным) — растём с запасом
+            grow = max(end - len(self._buffer), len(self._buffer))
+            if self.max_size is not None:
+                grow = min(grow, self.max_size - len(self._buffer))
+            self._buffer.extend(bytes(grow))
+        self._buffer[self._length:end] = chunk
+        self._length = end
+        return len(chunk)
+
+    def flush(self):
+        # aiogram вызывает flush после каждого чанка; буфер в памяти, сбрасывать нечего
+        pass
+
+    def value(self) -> bytearray:
+        """Скачанные байты. Буфер обрезается на месте, без копии."""
+        del self._buffer[self._length:]
+        return self._buffer
@@ -0,0 +1,193 @@
+# app/utils/cache.py
+import asyncio
+import json
+import logging
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from contextlib import closing
+from app.utils.sqlite import enable_wal
+
+logger = logging.getLogger(__name__)
+
+
+def approx_size(key, value) -> int:
+    """Грубая оценка памяти записи: ключ + значение + элементы кортежа/списка."""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей.
+    Все операции O(1): порядок использования хранится в OrderedDict.
+
+    Ограничивается числом записей и (опционально) примерным объёмом памяти.
+    У каждой записи может быть свой TTL. Если подключён SQLiteCacheStore,
+    новые записи копятся в памяти и пачками сбрасываются на диск в фоне,
+    а fetch() при промахе заглядывает в файл — туда пишут и другие процессы.
+    """
+
+    def __init__(self, max_items: int, ttl: float, max_bytes: int | None = None, store: "SQLiteCacheStore | None" = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.store = store
+        self._data: OrderedDict = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._dirty: dict = {}  # key -> (value, expires_at), ещё не записано на диск
+        self._clears = 0  # сколько раз вызывали clear(): неудачный сброс не вернёт стёртое
+        self._flush_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires_at, _ = item
+        if expires_at < time.time():
+            self._remove(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._insert(key, value, expires_at)
+        if self.store is not None:
+            self._dirty[key] = (value, expires_at)
+
+    def pop(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        self._remove(key)
+        return item[0]
+
+    def clear(self):
+        """Очищает память; ещё не записанные на диск записи тоже забываются."""
+        self._data.clear()
+        self._bytes = 0
+        self._dirty.clear()
+        self._clears += 1
+
+    def _insert(self, key, value, expires_at: float):
+        if key in self._data:
+            self._remove(key)
+        size = approx_size(key, value)
+        self._data[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._data) > self.max_items or (self.max_bytes and self._bytes > self.max_bytes and len(self._data) > 1):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    # --- Персистентный слой ---
+
+    async def fetch(self, key, default=None):
+        """get() с дочиткой из SQLite при промахе в памяти."""
+        value = self.get(key)
+        if value is not None or self.store is None:
+            return default if value is None else value
+        row = await asyncio.to_thread(self.store.get, key)
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at < time.time():
+            return default
+        self._insert(key, value, expires_at)
+        return value
+
+    async def load(self):
+        """Подгружает живые записи с диска, не блокируя event loop."""
+        if self.store is None:
+            return
+        rows = await asyncio.to_thread(self.store.load)
+        now = time.time()
+        for key, value, expires_at in rows:
+            # Свежие записи из памяти важнее того, что лежит на диске
+            if expires_at > now and key not in self._data:
+                self._insert(key, value, expires_at)
+        logger.info(f"Loaded {len(rows)} cache entries from {self.store.path}")
+
+    async def flush(self):
+        """Пишет накопленные записи на диск одной транзакцией в отдельном потоке."""
+        if self.store is None or not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        clears = self._clears
+        rows = [(key, value, expires_at) for key, (value, expires_at) in batch.items()]
+        try:
+            await asyncio.to_thread(self.store.write_many, rows)
+        except Exception as e:
+            logger.error(f"Cache flush failed: {e}")
+            if clears != self._clears:
+                return
+            # Вернём записи, чтобы попробовать в следующий раз
+            for key, item in batch.items():
+                self._dirty.setdefault(key, item)
+
+    def start_flusher(self, interval: float):
+        if self.store is not None and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop(interval))
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+class SQLiteCacheStore:
+    """Дисковый слой для TTLCache: значения хранятся как JSON."""
+
+    def __init__(self, path: str, table: str = "cache"):
+        self.path = path
+        self.table = table
+        with closing(self._connect()) as conn, conn:
+            enable_wal(conn)
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self) -> list[tuple]:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+            rows = conn.execute(f"SELECT key, value, expires_at FROM {self.table}").fetchall()
+        return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+
+    def get(self, key) -> tuple | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def write_many(self, rows: list[tuple]):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), expires_at) for key, value, expires_at in rows],
+            )
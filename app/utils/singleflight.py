@@ -0,0 +1,44 @@
+# app/utils/singleflight.py
+import asyncio
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом в одну задачу.
+
+    Пока задача по ключу выполняется, остальные вызовы просто ждут её
+    результат. Счётчики показывают, сколько вызовов удалось сэкономить;
+    если передан counter (метрика с метками flight и result), они
+    дублируются и туда.
+    """
+
+    def __init__(self, name: str = "", counter=None):
+        self.name = name
+        self.counter = counter
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, func, *args):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.collapsed += 1
+            if self.counter is not None:
+                self.counter.inc(flight=self.name, result="collapsed")
+        else:
+            self.calls += 1
+            if self.counter is not None:
+                self.counter.inc(flight=self.name, result="run")
+            task = asyncio.ensure_future(func(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отмена одного ожидающего не должна отменять общую задачу
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
@@ -0,0 +1,39 @@
+# app/utils/sqlite.py
+import asyncio
+import sqlite3
+import threading
+
+
+def enable_wal(conn: sqlite3.Connection):
+    """
+    WAL: читатели не ждут писателя, несколько процессов работают с одним файлом.
+    synchronous=NORMAL в WAL не теряет целостность, только последние транзакции при сбое питания.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class SQLiteDatabase:
+    """
+    Одно соединение с файлом SQLite на процесс. Запросы выполняются в потоке
+    (asyncio.to_thread) по очереди под блокировкой — они короткие, а открывать
+    соединение на каждую проверку лимита дороже самой проверки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        enable_wal(self._conn)
+        self._lock = threading.Lock()
+
+    def call(self, func, *args):
+        """Синхронный вызов func(conn, *args) в одной транзакции."""
+        with self._lock, self._conn:
+            return func(self._conn, *args)
+
+    async def run(self, func, *args):
+        return await asyncio.to_thread(self.call, func, *args)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,25 @@
+# app/utils/urls.py
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Приводит ссылку к каноничному виду для ключей кэша и дедупликации:
+    схема и хост в нижнем регистре, без порта по умолчанию и без #фрагмента.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").rstrip(".")
+        port = parts.port
+    except ValueError:
+        return url.strip()
+
+    netloc = host
+    if parts.username or parts.password:
+        netloc = f"{parts.username or ''}:{parts.password or ''}@{host}"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
@@ -1,11 +1,17 @@
 # main.py
+import argparse
 import asyncio
+import hmac
 import logging
+import multiprocessing
 import os
+import signal
 import sys
 from aiohttp import web
 from app.config import Settings
 from app.core import run_bot
+from app.services.http_client import create_http_session
+from app.services.metrics import render_metrics
 
 # --- Logging Setup ---
 # Setup logging before anything else
@@ -16,20 +22,37 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- Bot Task Management ---
-async def start_bot_task(app: web.Application):
-    """Starts the bot as a background task."""
+def load_settings() -> Settings:
+    """Loads settings once, before the web app is built."""
     logger.info("Loading settings for the bot...")
     try:
         settings_instance = Settings()
-        # Set logging level based on settings
-        log_level = logging.DEBUG if settings_instance.is_debug else logging.INFO
-        logging.getLogger().setLevel(log_level)
-        logger.info("Settings loaded. Starting bot polling...")
-        
+    except Exception as e:
+        logger.fatal(f"FATAL: Failed to load settings: {e}", exc_info=True)
+        sys.exit(1)
+
+    # Set logging level based on settings
+    log_level = logging.DEBUG if settings_instance.is_debug else logging.INFO
+    logging.getLogger().setLevel(log_level)
+    return settings_instance
+
+
+async def start_bot_task(app: web.Application):
+    """Starts the bot as a background task."""
+    try:
+        settings_instance = app['settings']
+        mode = "webhook" if settings_instance.use_webhook else "polling"
+        logger.info(f"Settings loaded. Starting bot in {mode} mode...")
+
+        # One pooled HTTP session shared by redirect resolution and Safe Browsing
+        app['http_session'] = create_http_session(settings_instance)
+
         # Create and store the bot task
-        app['bot_task'] = asyncio.create_task(run_bot(settings_instance))
-        logger.info("Bot polling task created.")
-        
+        app['bot_task'] = asyncio.create_task(
+            run_bot(settings_instance, app['http_session'], app.get('webhook_updates'))
+        )
+        logger.info(f"Bot {mode} task created.")
+
     except Exception as e:
         logger.fatal(f"FATAL: Failed to initialize and start bot task: {e}", exc_info=True)
         # Stop the application if bot fails to start
@@ -51,6 +74,10 @@ async def stop_bot_task(app: web.Application):
     else:
         logger.info("No running bot task found to stop.")
 
+    if 'http_session' in app and not app['http_session'].closed:
+        await app['http_session'].close()
+        logger.info("HTTP client session closed.")
+
 
 # --- Web Server Setup ---
 async def health_check(request: web.Request):
@@ -65,28 +92,134 @@ async def health_check(request: web.Request):
     return web.Response(text="Bot task is not running", status=503)
 
 
-def main():
-    """Main entry point for the application."""
-    if 'BOT_TOKEN' not in os.environ or not os.environ['BOT_TOKEN']:
-        logger.fatal("FATAL: BOT_TOKEN is not set in environment variables!")
-        sys.exit(1)
+async def metrics_handler(request: web.Request):
+    """
+    Prometheus scrape endpoint.
+    Counters are per process: with several workers each scrape hits one of them.
+    """
+    return web.Response(
+        body=render_metrics().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def telegram_webhook(request: web.Request):
+    """
+    Accepts a Telegram update and acks immediately.
+    Processing happens on the running loop in the bot task's workers.
+    """
+    settings_instance = request.app['settings']
+    # Settings refuses webhook mode without a secret; a missing one still rejects everything
+    secret = settings_instance.webhook_secret
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not secret or not hmac.compare_digest(token.encode(), secret.encode()):
+        logger.warning("Webhook request with invalid secret token rejected.")
+        return web.Response(status=401)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+
+    try:
+        request.app['webhook_updates'].put_nowait(data)
+    except asyncio.QueueFull:
+        # Telegram will redeliver the update later
+        logger.warning("Webhook queue is full, asking Telegram to retry.")
+        return web.Response(status=503)
+    return web.Response(status=200)
 
+
+def build_app(settings_instance: Settings) -> web.Application:
     app = web.Application()
-    
+    app['settings'] = settings_instance
+
     # Register health check on both root and /health
     app.router.add_get("/", health_check)
     app.router.add_get("/health", health_check)
+    app.router.add_get("/metrics", metrics_handler)
+
+    # Webhook mode: Telegram pushes updates to this server instead of long polling
+    if settings_instance.use_webhook:
+        app['webhook_updates'] = asyncio.Queue(maxsize=settings_instance.webhook_queue_size)
+        app.router.add_post(settings_instance.webhook_path, telegram_webhook)
 
     # Register startup and shutdown signals
     app.on_startup.append(start_bot_task)
     app.on_shutdown.append(stop_bot_task)
+    return app
 
-    port = int(os.environ.get("PORT", 10000))
-    
-    logger.info(f"Starting web server on port {port}...")
-    web.run_app(app, host="0.0.0.0", port=port, print=None)
+
+def serve(port: int, reuse_port: bool = False, settings_instance: Settings | None = None):
+    """Runs one bot process: web server plus the bot task. Spawned workers load settings themselves."""
+    settings_instance = settings_instance or load_settings()
+    logger.info(f"Starting web server on port {port} (pid {os.getpid()})...")
+    # reuse_port: the kernel spreads incoming webhook connections across workers
+    web.run_app(build_app(settings_instance), host="0.0.0.0", port=port, reuse_port=reuse_port, print=None)
     logger.info("Web server stopped.")
 
 
+def run_workers(port: int, workers: int):
+    """
+    Starts worker processes on the same port and waits for them.
+
+    The kernel picks a worker per connection, not per chat, so parts of one
+    album can reach different workers and are answered separately. The
+    inline-query debounce and /metrics counters are per process too.
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=serve, args=(port, True), name=f"bot-worker-{n}") for n in range(workers)]
+    # SIGTERM from the platform stops the parent; children are stopped in finally
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+    logger.info("All workers stopped.")
+
+
+def main():
+    """Main entry point for the application."""
+    if 'BOT_TOKEN' not in os.environ or not os.environ['BOT_TOKEN']:
+        logger.fatal("FATAL: BOT_TOKEN is not set in environment variables!")
+        sys.exit(1)
+
+    settings_instance = load_settings()
+    parser = argparse.ArgumentParser(description="QR Scanner Pro Bot")
+    parser.add_argument("--workers", type=int, default=settings_instance.workers,
+                        help="Bot processes (webhook mode only), default WORKERS")
+    args = parser.parse_args()
+
+    workers = max(args.workers, 1)
+    if workers > 1 and not settings_instance.use_webhook:
+        # Telegram allows only one getUpdates consumer per bot
+        logger.warning("Long polling supports a single worker; starting 1. Set WEBHOOK_BASE_URL to scale out.")
+        workers = 1
+    if workers > 1 and settings_instance.state_backend == "memory":
+        logger.warning("STATE_BACKEND=memory: rate limits, caches, stats and /qr dialogs are per worker. "
+                       "Use STATE_BACKEND=sqlite to share them.")
+
+    if workers > 1:
+        logger.warning(f"{workers} workers: updates are not routed by chat. Album parts may land on different "
+                       "workers (one reply and one rate-limit charge per part); inline debounce and /metrics "
+                       "are per process. Use a single worker if you rely on them.")
+
+    port = int(os.environ.get("PORT", 10000))
+    if workers == 1:
+        serve(port, settings_instance=settings_instance)
+    else:
+        logger.info(f"Starting {workers} workers on port {port}...")
+        run_workers(port, workers)
+
+
 if __name__ == "__main__":
     main()
@@ -1,11 +1,31 @@
-import os, asyncio
-from bot_setup import bot
+# set_webhook.py
+import asyncio
+import sys
+from aiogram import Bot
+from app.config import Settings
+from app.core import create_dispatcher
+
 
 async def main():
-    url = os.environ["BASE_WEBHOOK_URL"] + "/webhook"
-    await bot.set_webhook(url=url)
-    info = await bot.get_webhook_info()
-    print(f"Webhook установлен: {info.url}")
+    settings = Settings()
+    if not settings.use_webhook:
+        print("BASE_WEBHOOK_URL не задан — бот работает через polling.")
+        sys.exit(1)
+
+    bot = Bot(token=settings.bot_token)
+    dp = create_dispatcher(settings)
+    try:
+        await bot.set_webhook(
+            url=settings.webhook_url,
+            secret_token=settings.webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(settings.webhook_max_concurrency, 100),
+        )
+        info = await bot.get_webhook_info()
+        print(f"Webhook установлен: {info.url}")
+    finally:
+        await bot.session.close()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,49 @@
+# tests/test_buffers.py
+import asyncio
+import pytest
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from app.utils.buffers import FileTooLarge, PreallocatedBuffer
+
+TOKEN = "123456:TEST"
+FILE_PATH = "documents/file_1.png"
+
+
+async def _download(payload: bytes, size_hint: int | None, max_size: int | None) -> bytearray:
+    """Скачивает payload через Bot.download_file с локального сервера в PreallocatedBuffer."""
+    async def serve_file(request: web.Request):
+        return web.Response(body=payload)
+
+    app = web.Application()
+    app.router.add_get(f"/file/bot{TOKEN}/{FILE_PATH}", serve_file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://{host}:{port}"))
+    bot = Bot(token=TOKEN, session=session)
+    try:
+        buffer = PreallocatedBuffer(size_hint, max_size)
+        # Мелкие чанки — чтобы write и flush вызывались много раз
+        await bot.download_file(FILE_PATH, destination=buffer, chunk_size=1024, seek=False)
+        return buffer.value()
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+@pytest.mark.parametrize("size_hint", [100_000, None, 10])
+def test_download_through_aiogram(size_hint):
+    payload = bytes(range(256)) * 400
+    data = asyncio.run(_download(payload, size_hint, max_size=1_000_000))
+    assert data == payload
+    assert isinstance(data, bytearray)
+
+
+def test_download_over_limit_is_aborted():
+    with pytest.raises(FileTooLarge):
+        asyncio.run(_download(b"x" * 50_000, None, max_size=10_000))
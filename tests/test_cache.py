@@ -0,0 +1,31 @@
+# tests/test_cache.py
+import asyncio
+from app.utils.cache import SQLiteCacheStore, TTLCache
+
+
+def test_clear_drops_unflushed_entries(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    cache = TTLCache(max_items=10, ttl=60, store=store)
+    cache.set("old", 1)
+    cache.clear()
+    cache.set("new", 2)
+    asyncio.run(cache.flush())
+    assert [key for key, _, _ in store.load()] == ["new"]
+
+
+def test_failed_flush_does_not_restore_cleared_entries(tmp_path):
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"))
+    cache = TTLCache(max_items=10, ttl=60, store=store)
+
+    def write_many(rows):
+        # Кэш очистили, пока запись шла в потоке, и запись не удалась
+        cache.clear()
+        raise OSError("disk full")
+
+    original_write_many, store.write_many = store.write_many, write_many
+    cache.set("old", 1)
+    asyncio.run(cache.flush())
+    # Следующий сброс проходит, но стёртую запись на диск не пишет
+    store.write_many = original_write_many
+    asyncio.run(cache.flush())
+    assert store.load() == []
@@ -0,0 +1,63 @@
+# tests/test_decode_engine.py
+import asyncio
+import time
+import pytest
+from app.services.decode_engine import DecodeEngine
+
+
+def _hang():
+    time.sleep(60)
+
+
+def _slow_echo(value, delay):
+    time.sleep(delay)
+    return value
+
+
+async def _run_with_hung_neighbour():
+    engine = DecodeEngine(workers=2, queue_size=4, timeout=1.0)
+    await engine.start()
+    try:
+        hung = asyncio.create_task(engine.run(_hang))
+        # Соседняя задача ещё выполняется, когда зависшую убивают вместе с пулом
+        neighbour = asyncio.create_task(engine.run(_slow_echo, "ok", 1.5, timeout=10))
+        with pytest.raises(asyncio.TimeoutError):
+            await hung
+        return await neighbour
+    finally:
+        await engine.shutdown()
+
+
+def test_timeout_restarts_pool_and_retries_other_jobs():
+    assert asyncio.run(_run_with_hung_neighbour()) == "ok"
+
+
+async def _pool_is_usable_after_restart():
+    engine = DecodeEngine(workers=1, queue_size=2, timeout=0.5)
+    await engine.start()
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await engine.run(_hang)
+        return await engine.run(_slow_echo, 42, 0, timeout=10)
+    finally:
+        await engine.shutdown()
+
+
+def test_pool_is_usable_after_restart():
+    assert asyncio.run(_pool_is_usable_after_restart()) == 42
+
+
+async def _queued_jobs_do_not_time_out():
+    engine = DecodeEngine(workers=1, queue_size=4, timeout=1.0)
+    await engine.start()
+    try:
+        executor = engine._executor
+        # Каждая укладывается в таймаут, но третья ждёт своей очереди дольше него
+        results = await asyncio.gather(*(engine.run(_slow_echo, n, 0.6) for n in range(3)))
+        return results, engine._executor is executor
+    finally:
+        await engine.shutdown()
+
+
+def test_waiting_in_queue_does_not_count_towards_timeout():
+    assert asyncio.run(_queued_jobs_do_not_time_out()) == ([0, 1, 2], True)
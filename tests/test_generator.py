@@ -0,0 +1,35 @@
+# tests/test_generator.py
+import sys
+import threading
+from app.services import generator
+
+
+def test_render_cache_survives_concurrent_threads(monkeypatch):
+    # Частое переключение потоков, маленький кэш — вытеснения идут постоянно
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    monkeypatch.setattr(generator.render_cache, "max_items", 4)
+    generator.render_cache.clear()
+    errors = []
+
+    def worker(n: int):
+        try:
+            for i in range(300):
+                assert generator.render_qr_png(f"text {(i * 7 + n) % 9}", box_size=1).startswith(generator.PNG_SIGNATURE)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    cache = generator.render_cache
+    assert errors == []
+    assert len(cache) <= 4
+    assert cache.memory_bytes == sum(size for _, _, size in cache._data.values())
+    cache.clear()
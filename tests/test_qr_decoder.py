@@ -0,0 +1,91 @@
+# tests/test_qr_decoder.py
+import io
+import qrcode
+from PIL import Image
+from app.config import Settings
+from app.services import qr_decoder
+from app.services.qr_decoder import DecodeResult, decode_qr_ladder
+
+
+def _qr(text: str, box_size: int) -> Image.Image:
+    code = qrcode.QRCode(box_size=box_size, border=2)
+    code.add_data(text)
+    return code.make_image().get_image().convert("L")
+
+
+def _poster(image_format: str = "PNG", small: bool = True) -> bytes:
+    """Большой код и мелкий, который на уменьшенной копии не читается."""
+    canvas = Image.new("L", (2400, 1600), 255)
+    canvas.paste(_qr("big", 25), (100, 100))
+    if small:
+        canvas.paste(_qr("small", 4), (1800, 1200))
+    buf = io.BytesIO()
+    canvas.save(buf, image_format)
+    return buf.getvalue()
+
+
+# Где лежат коды на _poster() (left, top, right, bottom) — как их вернул бы find_qr_regions
+BIG_REGION = (80, 80, 820, 820)
+SMALL_REGION = (1780, 1180, 1920, 1320)
+
+
+def _count_decodes(monkeypatch) -> list:
+    calls = []
+    decode_image = qr_decoder._decode_image
+
+    def counting(image, multi=False):
+        calls.append(image.size)
+        return decode_image(image, multi)
+
+    monkeypatch.setattr(qr_decoder, "_decode_image", counting)
+    return calls
+
+
+def test_multi_stops_at_first_successful_stage(monkeypatch):
+    # Мелкий код локатор не видит — повода идти дальше уменьшенной копии нет
+    monkeypatch.setattr(qr_decoder, "find_qr_regions", lambda gray, max_regions: [BIG_REGION])
+    calls = _count_decodes(monkeypatch)
+    result = decode_qr_ladder(_poster(), Settings(bot_token="123456:TEST"), multi=True)
+    assert (result.stage, [code.content for code in result.codes], result.incomplete) == ("downscaled", ["big"], False)
+    assert len(calls) == 1
+
+
+def test_multi_continues_while_locator_sees_unread_regions(monkeypatch):
+    monkeypatch.setattr(qr_decoder, "find_qr_regions", lambda gray, max_regions: [BIG_REGION, SMALL_REGION])
+    calls = _count_decodes(monkeypatch)
+    result = decode_qr_ladder(_poster(), Settings(bot_token="123456:TEST"), multi=True)
+    assert result.stage == "downscaled"
+    assert [code.content for code in result.codes] == ["big", "small"]
+    assert not result.incomplete
+    # downscaled + два кропа roi; full уже не нужен
+    assert len(calls) == 3
+
+
+def test_multi_marks_unread_regions_as_incomplete(monkeypatch):
+    # Локатор видит область, где кода так и не нашлось ни на одной ступени
+    monkeypatch.setattr(qr_decoder, "find_qr_regions", lambda gray, max_regions: [BIG_REGION, SMALL_REGION])
+    result = decode_qr_ladder(_poster(small=False), Settings(bot_token="123456:TEST"), multi=True)
+    assert [code.content for code in result.codes] == ["big"]
+    assert result.incomplete
+
+
+def test_single_mode_stops_at_first_stage():
+    result = decode_qr_ladder(_poster(), Settings(bot_token="123456:TEST"))
+    assert (result.content, result.stage) == ("big", "downscaled")
+
+
+def test_multi_stops_at_max_codes(monkeypatch):
+    monkeypatch.setattr(qr_decoder, "find_qr_regions", lambda gray, max_regions: [BIG_REGION, SMALL_REGION])
+    settings = Settings(bot_token="123456:TEST", decode_max_codes=1)
+    result = decode_qr_ladder(_poster(), settings, multi=True)
+    assert ([code.content for code in result.codes], result.incomplete) == (["big"], False)
+
+
+def test_rejects_image_over_pixel_cap():
+    settings = Settings(bot_token="123456:TEST", decode_max_pixels=2400 * 1600 - 1)
+    assert decode_qr_ladder(_poster(), settings, multi=True) == DecodeResult(None, None)
+
+
+def test_pixel_cap_applies_after_jpeg_draft():
+    settings = Settings(bot_token="123456:TEST", decode_max_pixels=2400 * 1600 - 1, decode_draft_side=1200)
+    assert decode_qr_ladder(_poster("JPEG"), settings).content == "big"
@@ -0,0 +1,98 @@
+# tests/test_redirects.py
+import asyncio
+from aiohttp import web
+from app.config import Settings
+from app.services.http_client import create_http_session
+from app.services.metrics import SINGLEFLIGHT_CALLS
+from app.services.redirects import resolve_redirect_chain
+
+
+async def _resolve(path: str, **overrides) -> tuple[list[str], str]:
+    async def head_hangs(request: web.Request):
+        await asyncio.sleep(1.5)
+        return web.Response()
+
+    async def head_fails(request: web.Request):
+        # Обрываем соединение без ответа
+        request.transport.close()
+        return web.Response()
+
+    async def start(request: web.Request):
+        raise web.HTTPFound("/final")
+
+    async def final(request: web.Request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/slow-head", head_hangs)
+    app.router.add_get("/slow-head", start, allow_head=False)
+    app.router.add_route("HEAD", "/broken-head", head_fails)
+    app.router.add_get("/broken-head", start, allow_head=False)
+    app.router.add_get("/final", final)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    base = f"http://{host}:{port}"
+
+    settings = Settings(bot_token="123456:TEST", **{"redirect_hop_timeout": 0.3, "redirect_deadline": 5.0, **overrides})
+    session = create_http_session(settings)
+    try:
+        chain = await resolve_redirect_chain(f"{base}{path}", session, settings)
+    finally:
+        await session.close()
+        await runner.cleanup()
+    return chain, base
+
+
+def test_head_timeout_falls_back_to_get():
+    chain, base = asyncio.run(_resolve("/slow-head"))
+    assert chain == [f"{base}/slow-head", f"{base}/final"]
+
+
+def test_head_error_falls_back_to_get():
+    chain, base = asyncio.run(_resolve("/broken-head"))
+    assert chain == [f"{base}/broken-head", f"{base}/final"]
+
+
+def test_deadline_stops_the_chain(caplog):
+    with caplog.at_level("INFO", logger="app.services.redirects"):
+        chain, base = asyncio.run(_resolve("/slow-head", redirect_hop_timeout=1.0, redirect_deadline=0.5))
+    assert chain == [f"{base}/slow-head"]
+    assert "deadline exceeded" in caplog.text
+
+
+async def _resolve_collapsed(urls_for) -> tuple[list[list[str]], list[str]]:
+    """Одновременно резолвит ссылки (одна и та же страница в разном написании) через resolve_url."""
+    from app.core import resolve_url
+
+    async def page(request: web.Request):
+        await asyncio.sleep(0.2)
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/page", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    urls = urls_for(f"http://{host}:{port}")
+
+    settings = Settings(bot_token="123456:TEST", redirect_hop_timeout=2.0, redirect_deadline=5.0)
+    session = create_http_session(settings)
+    try:
+        chains = await asyncio.gather(*(resolve_url(url, session, settings) for url in urls))
+    finally:
+        await session.close()
+        await runner.cleanup()
+    return chains, urls
+
+
+def test_collapsed_caller_gets_its_own_url_first():
+    collapsed_before = SINGLEFLIGHT_CALLS.value(flight="resolve", result="collapsed")
+    chains, urls = asyncio.run(_resolve_collapsed(lambda base: [f"{base}/page", f"{base}/page#top"]))
+    # Общий резолв, но редиректа нет ни для одного из вызовов
+    assert SINGLEFLIGHT_CALLS.value(flight="resolve", result="collapsed") - collapsed_before == 1
+    assert chains == [[urls[0]], [urls[1]]]
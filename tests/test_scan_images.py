@@ -0,0 +1,74 @@
+# tests/test_scan_images.py
+import asyncio
+import io
+import qrcode
+from aiogram.types import PhotoSize
+from PIL import Image
+from app import core
+from app.config import Settings
+from app.middlewares.admission import AdmissionController
+from app.services import qr_decoder
+from app.services.decode_cache import DecodeCache
+
+SIDES = (320, 800, 1280)
+
+
+def _photo(side: int, small_code: bool) -> bytes:
+    """Кадр с крупным кодом; на крупных размерах ещё и мелкий в углу."""
+    canvas = Image.new("L", (side, side), 255)
+    big = qrcode.QRCode(box_size=max(2, side // 60), border=2)
+    big.add_data("big")
+    canvas.paste(big.make_image().get_image().convert("L"), (side // 20, side // 20))
+    if small_code and side >= 800:
+        small = qrcode.QRCode(box_size=3, border=2)
+        small.add_data("small")
+        canvas.paste(small.make_image().get_image().convert("L"), (side - 100, side - 100))
+    buf = io.BytesIO()
+    canvas.save(buf, "PNG")
+    return buf.getvalue()
+
+
+class InlineEngine:
+    """Распознаёт прямо в тесте и считает вызовы."""
+
+    def __init__(self):
+        self.batches = 0
+
+    async def decode_batch(self, images, settings, multi=False):
+        self.batches += 1
+        return qr_decoder.decode_qr_batch(images, settings, multi)
+
+
+async def _scan(monkeypatch, regions) -> tuple[list, list[int], int]:
+    settings = Settings(bot_token="123456:TEST")
+    files = {f"file_{side}": side for side in SIDES}
+    downloads = []
+
+    async def download_file_bytes(bot, file_id, max_size=None):
+        downloads.append(files[file_id])
+        return bytearray(_photo(files[file_id], small_code=True))
+
+    monkeypatch.setattr(core, "download_file_bytes", download_file_bytes)
+    monkeypatch.setattr(qr_decoder, "find_qr_regions", regions)
+    ladder = [PhotoSize(file_id=f"file_{side}", file_unique_id=f"u{side}", width=side, height=side) for side in SIDES]
+    engine = InlineEngine()
+    results = await core.scan_images([ladder], None, settings, engine, DecodeCache(100, 60),
+                                     AdmissionController(settings), chat_id=1)
+    return results, downloads, engine.batches
+
+
+def test_photo_with_a_code_stops_at_first_size(monkeypatch):
+    # Локатор не видит ничего, кроме уже прочитанного кода
+    results, downloads, batches = asyncio.run(_scan(monkeypatch, lambda gray, max_regions: []))
+    assert results == [["big"]]
+    assert (downloads, batches) == ([320], 1)
+
+
+def test_unread_region_escalates_to_larger_size(monkeypatch):
+    def regions(gray, max_regions):
+        # Правый нижний угол похож на QR; прочитать его удаётся только на крупном кадре
+        return [(gray.width - 120, gray.height - 120, gray.width, gray.height)]
+
+    results, downloads, _ = asyncio.run(_scan(monkeypatch, regions))
+    assert results == [["big", "small"]]
+    assert downloads == [320, 800]
@@ -0,0 +1,75 @@
+# tests/test_security.py
+"""check_url_safety целиком: батчер, кэш и HTTP против локальной заглушки Safe Browsing."""
+import asyncio
+from aiohttp import web
+from app.config import Settings
+from app.services import security
+from app.services.http_client import create_http_session
+from app.services.metrics import SAFE_BROWSING_REQUESTS, SAFE_BROWSING_URLS, render_metrics
+from tools import safebrowsing_stub
+
+BAD_URL = "http://evil.test/login"
+
+
+async def _check(urls: list[str], **stub_options) -> tuple[list, dict]:
+    """Поднимает заглушку, проверяет urls по очереди и возвращает результаты и статистику заглушки."""
+    stub = safebrowsing_stub.create_app({BAD_URL: "SOCIAL_ENGINEERING"}, **stub_options)
+    runner = web.AppRunner(stub)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    settings = Settings(
+        bot_token="123456:TEST",
+        gsb_api_key="stub",
+        gsb_api_url=f"http://{host}:{port}/v4",
+        gsb_batch_window_ms=1,
+        request_timeout=1,
+        url_cache_db_path=None,
+    )
+    security.url_safety_cache.clear()
+    session = create_http_session(settings)
+    try:
+        results = [await security.check_url_safety(url, settings, session) for url in urls]
+    finally:
+        await session.close()
+        await runner.cleanup()
+        security.url_safety_cache.clear()
+    return results, stub['stats']
+
+
+def test_safe_url():
+    results, stats = asyncio.run(_check(["https://example.com/"]))
+    assert results == [(True, None)]
+    assert stats['requests'] == 1
+
+
+def test_malicious_url():
+    results, _ = asyncio.run(_check([BAD_URL]))
+    assert results == [(False, "SOCIAL_ENGINEERING")]
+
+
+def test_verdict_is_cached():
+    requests_before = SAFE_BROWSING_REQUESTS.value(method="threatMatches:find")
+    urls_before = SAFE_BROWSING_URLS.value()
+    results, stats = asyncio.run(_check([BAD_URL, BAD_URL, "https://example.com/", "https://example.com/"]))
+    assert results == [(False, "SOCIAL_ENGINEERING")] * 2 + [(True, None)] * 2
+    assert stats['requests'] == 2
+    # Запросы к API видны в /metrics
+    assert SAFE_BROWSING_REQUESTS.value(method="threatMatches:find") - requests_before == 2
+    assert SAFE_BROWSING_URLS.value() - urls_before == 2
+    assert 'qrbot_safebrowsing_requests_total{method="threatMatches:find"}' in render_metrics()
+
+
+def test_server_error_is_not_a_verdict_and_not_cached():
+    results, stats = asyncio.run(_check(["https://example.com/", "https://example.com/"], fail_status=503))
+    assert all(is_safe is None for is_safe, _ in results)
+    assert results[0][1] == "API error: 503"
+    # Ошибку не кэшируем — второй вызов снова идёт в API
+    assert stats['requests'] == 2
+
+
+def test_timeout_is_not_a_verdict():
+    results, _ = asyncio.run(_check([BAD_URL], latency=2.0))
+    assert results == [(None, "Request timeout")]
@@ -0,0 +1,23 @@
+# tests/test_stats_store.py
+import asyncio
+from app.services.stats_store import StatsStore
+
+
+async def _record_and_reload(path: str) -> tuple[StatsStore, StatsStore]:
+    stats = StatsStore(path)
+    stats.record_scan(["url", "text", "url"])
+    stats.record_scan(["wifi"])
+    await stats.flush()
+
+    restored = StatsStore(path)
+    await restored.load()
+    return stats, restored
+
+
+def test_scan_counts_image_once_and_codes_separately(tmp_path):
+    stats, restored = asyncio.run(_record_and_reload(str(tmp_path / "stats.txt")))
+    assert (stats.total_scans, stats.total_codes, stats.today_scans) == (2, 4, 2)
+    assert stats.by_type == {"url": 2, "text": 1, "wifi": 1}
+    # Переживает перезапуск
+    assert (restored.total_scans, restored.total_codes, restored.today_scans) == (2, 4, 2)
+    assert restored.by_type == stats.by_type
@@ -0,0 +1,95 @@
+# tests/test_threat_lists.py
+import asyncio
+import base64
+import hashlib
+from aiohttp import web
+from app.config import Settings
+from app.services import security
+from app.services.http_client import create_http_session
+from app.services.metrics import SAFE_BROWSING_REQUESTS, THREAT_LIST_LOCAL_VERDICTS
+from app.services.threat_lists import ThreatList, ThreatListDatabase
+from tools import safebrowsing_stub
+
+# По ссылке на каждый список: пустой список база считает незагруженным
+BAD_URLS = {
+    "http://malware.test/": "MALWARE",
+    "http://phish.test/login": "SOCIAL_ENGINEERING",
+    "http://unwanted.test/": "UNWANTED_SOFTWARE",
+    "http://harmful.test/": "POTENTIALLY_HARMFUL_APPLICATION",
+}
+
+
+def _update(prefixes: list[bytes], checksum_of: bytes) -> dict:
+    return {
+        "responseType": "FULL_UPDATE",
+        "newClientState": "state-1",
+        "additions": [{"rawHashes": {"prefixSize": 4, "rawHashes": base64.b64encode(b"".join(prefixes)).decode()}}],
+        "checksum": {"sha256": base64.b64encode(hashlib.sha256(checksum_of).digest()).decode()},
+    }
+
+
+def test_checksum_mismatch_resets_list():
+    lst = ThreatList("MALWARE", "ANY_PLATFORM", "URL")
+    prefixes = [b"aaaa", b"bbbb"]
+    assert lst.apply_update(_update(prefixes, b"".join(prefixes)))
+    assert lst.ready and lst.state == "state-1"
+
+    assert not lst.apply_update(_update(prefixes, b"corrupt"))
+    assert not lst.ready
+    assert lst.state == "" and len(lst.prefixes) == 0
+
+
+async def _mismatch_falls_back_to_lookup_api():
+    stub = safebrowsing_stub.create_app(BAD_URLS)
+    stub['corrupt_checksums'] = True
+    runner = web.AppRunner(stub)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    settings = Settings(
+        bot_token="123456:TEST",
+        gsb_api_key="stub",
+        gsb_api_url=f"http://{host}:{port}/v4",
+        gsb_batch_window_ms=1,
+        request_timeout=1,
+        url_cache_db_path=None,
+    )
+    session = create_http_session(settings)
+    db = ThreatListDatabase(settings)
+    security.url_safety_cache.clear()
+    security.threat_db = db
+    local_before = THREAT_LIST_LOCAL_VERDICTS.value()
+    try:
+        await db.sync(session)
+        # Синхронизация прошла, но суммы не сошлись — локальным вердиктам верить нельзя
+        assert db.last_sync is not None and not db.ready
+        assert await security.check_url_safety("http://phish.test/login", settings, session) == (False, "SOCIAL_ENGINEERING")
+        assert await security.check_url_safety("https://example.com/", settings, session) == (True, None)
+        assert stub['stats']['requests'] == 2
+        assert THREAT_LIST_LOCAL_VERDICTS.value() == local_before
+
+        # Полное обновление с верной суммой — снова проверяем локально
+        stub['corrupt_checksums'] = False
+        await db.sync(session)
+        assert db.ready
+        assert await security.check_url_safety("https://example.org/", settings, session) == (True, None)
+        assert stub['stats']['requests'] == 2
+        assert THREAT_LIST_LOCAL_VERDICTS.value() == local_before + 1
+
+        # Совпал префикс — уточняем через fullHashes:find, и это видно в метриках
+        full_hash_before = SAFE_BROWSING_REQUESTS.value(method="fullHashes:find")
+        security.url_safety_cache.clear()
+        assert await security.check_url_safety("http://phish.test/login", settings, session) == (False, "SOCIAL_ENGINEERING")
+        assert SAFE_BROWSING_REQUESTS.value(method="fullHashes:find") - full_hash_before == 1
+        assert stub['stats']['full_hash_requests'] == 1
+    finally:
+        security.threat_db = None
+        security.url_safety_cache.clear()
+        await session.close()
+        await runner.cleanup()
+
+
+def test_checksum_mismatch_falls_back_to_lookup_api():
+    asyncio.run(_mismatch_falls_back_to_lookup_api())
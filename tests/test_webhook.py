@@ -0,0 +1,30 @@
+# tests/test_webhook.py
+import asyncio
+import pytest
+from aiohttp.test_utils import make_mocked_request
+from app.config import Settings
+from main import build_app, telegram_webhook
+
+
+def test_webhook_mode_requires_secret():
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        Settings(bot_token="123456:TEST", webhook_base_url="https://bot.example")
+
+
+async def _post(token: str | None) -> tuple[int, int]:
+    settings = Settings(bot_token="123456:TEST", webhook_base_url="https://bot.example", webhook_secret="s3cret")
+    app = build_app(settings)
+    headers = {} if token is None else {"X-Telegram-Bot-Api-Secret-Token": token}
+    request = make_mocked_request("POST", settings.webhook_path, headers=headers, app=app)
+
+    async def body():
+        return {"update_id": 1}
+
+    request.json = body
+    response = await telegram_webhook(request)
+    return response.status, app['webhook_updates'].qsize()
+
+
+@pytest.mark.parametrize("token, expected", [("s3cret", (200, 1)), ("wrong", (401, 0)), (None, (401, 0))])
+def test_webhook_checks_secret_token(token, expected):
+    assert asyncio.run(_post(token)) == expected
@@ -0,0 +1,293 @@
+# tools/bench_decode.py
+"""
+Бенчмарк распознавания QR: скорость и доля успешных чтений.
+
+Корпус строится детерминированно (по --seed) генератором бота и портится
+по классам: поворот, размытие, сжатие JPEG, шум, мелкие модули, код
+внутри большого снимка. Корпус прогоняется через decode_qr_ladder в
+режиме multi, как в боте: последовательно в одном процессе-воркере и в
+пуле процессов. Воркеры запускаются через spawn и получают по одной
+картинке, поэтому их пиковая память — это память распознавания, без
+корпуса и его построения.
+
+Запуск:
+    python -m tools.bench_decode                      # отчёт + сравнение с базой
+    python -m tools.bench_decode --update-baseline    # записать новую базу
+    python -m tools.bench_decode --no-timing          # сравнивать только качество
+
+База (tools/bench_decode_baseline.json) хранится в репозитории и
+записывается на эталонной машине; при регрессии скрипт завершается с
+кодом 1, без базы — с кодом 2.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from itertools import repeat
+from typing import NamedTuple
+
+import qrcode
+from PIL import Image, ImageFilter
+
+from app.config import Settings
+from app.services.generator import render_qr_png
+from app.services.qr_decoder import decode_qr_ladder
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_decode_baseline.json")
+
+ERROR_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+# Длина текста задаёт версию QR: ~2, ~7 и ~15 при уровне L
+PAYLOAD_LENGTHS = (20, 120, 500)
+
+# Допустимое падение доли успешных чтений (абсолютное) и отклонение скорости (относительное)
+SUCCESS_TOLERANCE = 0.02
+TIMING_TOLERANCE = 0.30
+
+
+class Case(NamedTuple):
+    degradation: str
+    image_bytes: bytes
+    expected: str
+
+
+def _payload(rng: random.Random, length: int) -> str:
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    prefix = "https://example.com/"
+    return prefix + "".join(rng.choice(alphabet) for _ in range(max(1, length - len(prefix))))
+
+
+def _render(rng: random.Random, box_size: int) -> tuple[Image.Image, str]:
+    text = _payload(rng, rng.choice(PAYLOAD_LENGTHS))
+    level = ERROR_LEVELS[rng.choice(tuple(ERROR_LEVELS))]
+    png = render_qr_png(text, box_size=box_size, border=4, error_correction=level)
+    return Image.open(io.BytesIO(png)).convert("L"), text
+
+
+def _noise(rng: random.Random, image: Image.Image, amount: float) -> Image.Image:
+    noise = Image.frombytes("L", image.size, rng.randbytes(image.width * image.height))
+    return Image.blend(image, noise, amount)
+
+
+def _encode(image: Image.Image, jpeg_quality: int | None = None) -> bytes:
+    bio = io.BytesIO()
+    if jpeg_quality is None:
+        image.save(bio, "PNG")
+    else:
+        image.convert("RGB").save(bio, "JPEG", quality=jpeg_quality)
+    return bio.getvalue()
+
+
+def _background(rng: random.Random, size: tuple[int, int]) -> Image.Image:
+    """Большой «снимок»: плавный градиент с зерном."""
+    gradient = Image.linear_gradient("L").resize(size).rotate(rng.uniform(0, 360), fillcolor=128)
+    return _noise(rng, gradient.point(lambda v: 80 + v // 2), 0.15)
+
+
+def _degrade(rng: random.Random, degradation: str) -> tuple[bytes, str]:
+    if degradation == "clean":
+        image, text = _render(rng, rng.choice((4, 6, 8)))
+        return _encode(image), text
+    if degradation == "small_modules":
+        image, text = _render(rng, rng.choice((2, 3)))
+        return _encode(image), text
+    if degradation == "rotation":
+        image, text = _render(rng, 6)
+        angle = rng.choice((10, 25, 45)) * rng.choice((1, -1))
+        return _encode(image.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)), text
+    if degradation == "blur":
+        image, text = _render(rng, 6)
+        return _encode(image.filter(ImageFilter.GaussianBlur(rng.choice((1.0, 2.0, 3.0))))), text
+    if degradation == "jpeg":
+        image, text = _render(rng, 6)
+        return _encode(image, jpeg_quality=rng.choice((30, 15, 8))), text
+    if degradation == "noise":
+        image, text = _render(rng, 6)
+        return _encode(_noise(rng, image, rng.choice((0.2, 0.35, 0.5)))), text
+    if degradation == "placement":
+        image, text = _render(rng, 4)
+        background = _background(rng, (3024, 4032))
+        x = rng.randrange(0, background.width - image.width)
+        y = rng.randrange(0, background.height - image.height)
+        background.paste(image, (x, y))
+        return _encode(background, jpeg_quality=85), text
+    if degradation == "combined":
+        image, text = _render(rng, 6)
+        image = image.rotate(rng.uniform(-20, 20), resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+        image = _noise(rng, image.filter(ImageFilter.GaussianBlur(1.0)), 0.2)
+        return _encode(image, jpeg_quality=40), text
+    raise ValueError(f"Unknown degradation: {degradation}")
+
+
+DEGRADATIONS = ("clean", "small_modules", "rotation", "blur", "jpeg", "noise", "placement", "combined")
+
+
+def build_corpus(seed: int, per_class: int) -> list[Case]:
+    rng = random.Random(seed)
+    corpus = []
+    for degradation in DEGRADATIONS:
+        for _ in range(per_class):
+            image_bytes, text = _degrade(rng, degradation)
+            corpus.append(Case(degradation, image_bytes, text))
+    return corpus
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def decode_codes(image_bytes: bytes, settings) -> tuple[str, ...]:
+    """Тексты всех кодов кадра — как их распознаёт бот (режим multi)."""
+    return tuple(code.content for code in decode_qr_ladder(image_bytes, settings, multi=True).codes)
+
+
+def _decode_timed(image_bytes: bytes, settings) -> tuple[tuple[str, ...], float]:
+    started = time.perf_counter()
+    codes = decode_codes(image_bytes, settings)
+    return codes, time.perf_counter() - started
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_serial(corpus: list[Case], settings) -> dict:
+    latencies = []
+    hits: dict[str, list[bool]] = {}
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        # Прогрев: импорт библиотек в воркере не должен попадать в замер
+        executor.submit(decode_codes, corpus[0].image_bytes, settings).result()
+        for case in corpus:
+            # Время меряется в воркере — без передачи картинки между процессами
+            codes, latency = executor.submit(_decode_timed, case.image_bytes, settings).result()
+            latencies.append(latency)
+            hits.setdefault(case.degradation, []).append(case.expected in codes)
+        peak_rss_mb = executor.submit(_peak_rss_mb).result()
+
+    return {
+        "images_per_sec": len(corpus) / sum(latencies),
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb,
+        "success_rate": {name: sum(results) / len(results) for name, results in hits.items()},
+    }
+
+
+def run_parallel(corpus: list[Case], settings, workers: int) -> dict:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        # Прогрев: импорт библиотек в воркерах не должен попадать в замер
+        list(executor.map(decode_codes, [corpus[0].image_bytes] * workers, repeat(settings)))
+        started = time.perf_counter()
+        list(executor.map(decode_codes, (case.image_bytes for case in corpus), repeat(settings)))
+        elapsed = time.perf_counter() - started
+    return {
+        "workers": workers,
+        "images_per_sec": len(corpus) / elapsed,
+        # Максимум по завершённым дочерним процессам (включая воркер run_serial)
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def compare(report: dict, baseline: dict, timing: bool) -> list[str]:
+    """Список регрессий относительно базы (пустой — всё в порядке)."""
+    failures = []
+    if baseline.get("seed") != report["seed"] or baseline.get("per_class") != report["per_class"]:
+        failures.append("baseline was recorded for a different corpus (seed/per_class)")
+        return failures
+
+    for name, rate in baseline["serial"]["success_rate"].items():
+        current = report["serial"]["success_rate"].get(name, 0.0)
+        if current < rate - SUCCESS_TOLERANCE:
+            failures.append(f"success rate '{name}': {current:.1%} < baseline {rate:.1%}")
+
+    if timing:
+        checks = (
+            ("serial images/sec", report["serial"]["images_per_sec"], baseline["serial"]["images_per_sec"], -1),
+            ("parallel images/sec", report["parallel"]["images_per_sec"], baseline["parallel"]["images_per_sec"], -1),
+            ("serial p95 ms", report["serial"]["p95_ms"], baseline["serial"]["p95_ms"], 1),
+        )
+        for label, current, base, direction in checks:
+            if direction < 0 and current < base * (1 - TIMING_TOLERANCE):
+                failures.append(f"{label}: {current:.1f} < baseline {base:.1f}")
+            if direction > 0 and current > base * (1 + TIMING_TOLERANCE):
+                failures.append(f"{label}: {current:.1f} > baseline {base:.1f}")
+    return failures
+
+
+def print_report(report: dict):
+    serial, parallel = report["serial"], report["parallel"]
+    print(f"Corpus: {report['images']} images (seed {report['seed']}, {report['per_class']} per class)")
+    print(f"Serial:   {serial['images_per_sec']:.1f} img/s, p50 {serial['p50_ms']:.1f} ms, "
+          f"p95 {serial['p95_ms']:.1f} ms, p99 {serial['p99_ms']:.1f} ms, peak worker RSS {serial['peak_rss_mb']:.0f} MB")
+    print(f"Parallel: {parallel['images_per_sec']:.1f} img/s with {parallel['workers']} workers, "
+          f"peak worker RSS {parallel['peak_rss_mb']:.0f} MB")
+    print("Success rate:")
+    for name, rate in serial["success_rate"].items():
+        print(f"  {name:<14} {rate:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QR decode benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--per-class", type=int, default=24, help="Images per degradation class")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--no-timing", action="store_true", help="Compare success rates only")
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    settings = Settings(bot_token="benchmark")
+    corpus = build_corpus(args.seed, args.per_class)
+    report = {
+        "seed": args.seed,
+        "per_class": args.per_class,
+        "images": len(corpus),
+        "serial": run_serial(corpus, settings),
+        "parallel": run_parallel(corpus, settings, args.workers),
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        # Без базы сравнивать не с чем — это ошибка, а не «регрессий нет»
+        print(f"No baseline at {args.baseline}; record one with --update-baseline")
+        sys.exit(2)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = compare(report, baseline, timing=not args.no_timing)
+    if failures:
+        print("REGRESSIONS:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
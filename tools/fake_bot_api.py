@@ -0,0 +1,89 @@
+# tools/fake_bot_api.py
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Отдаёт getFile и сами файлы (картинки регистрируются через add_file),
+принимает sendMessage/sendPhoto/sendChatAction/deleteMessage и прочие
+методы, считая вызовы каждого. Для ссылок из QR есть
+/landing/<n> (обычная страница) и /redirect/<n> (редирект на неё), чтобы
+проверка редиректов не ходила в интернет.
+
+Бот подключается через TELEGRAM_API_URL=http://127.0.0.1:<port>.
+"""
+import asyncio
+import itertools
+import time
+from aiohttp import web
+
+def _message(message_id: int, chat_id: int, **extra) -> dict:
+    return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, **extra}
+
+
+async def api_method(request: web.Request):
+    app = request.app
+    if app['latency']:
+        await asyncio.sleep(app['latency'])
+
+    method = request.match_info['method']
+    params = dict(await request.post())
+    app['stats'][method] = app['stats'].get(method, 0) + 1
+    chat_id = int(params.get('chat_id') or 0)
+
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+    elif method == "getFile":
+        file_id = params['file_id']
+        data = app['files'].get(file_id)
+        if data is None:
+            return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: file not found"})
+        result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(data), "file_path": f"files/{file_id}"}
+    elif method == "sendMessage":
+        result = _message(next(app['message_ids']), chat_id, text=params.get('text', ''))
+    elif method == "sendPhoto":
+        photo_id = f"sent-{next(app['message_ids'])}"
+        photo = [{"file_id": photo_id, "file_unique_id": photo_id, "width": 512, "height": 512}]
+        result = _message(next(app['message_ids']), chat_id, photo=photo)
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+async def download_file(request: web.Request):
+    app = request.app
+    if app['latency']:
+        await asyncio.sleep(app['latency'])
+    data = app['files'].get(request.match_info['path'].removeprefix("files/"))
+    if data is None:
+        raise web.HTTPNotFound()
+    return web.Response(body=data, content_type="application/octet-stream")
+
+
+async def landing(request: web.Request):
+    return web.Response(text="ok")
+
+
+async def redirect(request: web.Request):
+    raise web.HTTPFound(f"/landing/{request.match_info['n']}")
+
+
+async def get_stats(request: web.Request):
+    return web.json_response(request.app['stats'])
+
+
+def add_file(app: web.Application, file_id: str, data: bytes):
+    """Регистрирует файл, который бот сможет скачать по file_id."""
+    app['files'][file_id] = data
+
+
+def create_app(latency: float = 0.0) -> web.Application:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['latency'] = latency
+    app['files'] = {}
+    app['stats'] = {}
+    app['message_ids'] = itertools.count(1)
+    app.router.add_post("/bot{token}/{method}", api_method)
+    app.router.add_get("/file/bot{token}/{path:.+}", download_file)
+    app.router.add_route("*", "/landing/{n}", landing)
+    app.router.add_route("*", "/redirect/{n}", redirect)
+    app.router.add_get("/stats", get_stats)
+    return app
@@ -0,0 +1,287 @@
+# tools/loadtest.py
+"""
+Нагрузочный тест бота без Telegram.
+
+Поднимает заглушки Bot API (tools.fake_bot_api) и Safe Browsing
+(tools.safebrowsing_stub), запускает настоящий run_bot в режиме вебхука и
+с заданной частотой подаёт в его очередь синтетические апдейты: фото с QR
+(ссылки, редиректы, опасные ссылки, фото без кода), /qr и обычный текст.
+
+Отчёт: пропускная способность, задержка от постановки апдейта в очередь
+до конца его обработки (p50/p95/p99 по типам), лаг event loop, рост RSS
+и число вызовов Bot API / Safe Browsing.
+
+Запуск:
+    python -m tools.loadtest --updates 5000 --rate 200
+    python -m tools.loadtest --mix photo=1 --set webhook_max_concurrency=64 --set admission_decodes=4
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from aiohttp import web
+from PIL import Image
+
+from app.config import Settings
+from app.core import run_bot
+from app.services.generator import render_qr_png
+from app.services.http_client import create_http_session
+from app.services.metrics import STAGE_SECONDS
+from tools import fake_bot_api, safebrowsing_stub
+
+
+# update_id, взятый последним get() в этом контексте
+_current_update: ContextVar[int | None] = ContextVar("current_update", default=None)
+
+
+class TimedQueue(asyncio.Queue):
+    """
+    Очередь вебхука, которая замеряет время обработки каждого апдейта.
+    process_webhook_updates закрывает апдейт task_done() либо в воркере, который
+    его взял, либо в задаче, созданной из воркера после get(). Задача копирует
+    контекст, поэтому update_id ищем в contextvar, а не по текущей задаче.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.enqueued: dict[int, float] = {}
+        self.latencies: dict[int, float] = {}  # update_id -> секунды
+        # Первый get() — значит, run_bot поднял сервисы и воркеры ждут апдейтов
+        self.consuming = asyncio.Event()
+
+    def put_update(self, data: dict) -> bool:
+        try:
+            self.put_nowait(data)
+        except asyncio.QueueFull:
+            return False
+        self.enqueued[data["update_id"]] = time.perf_counter()
+        return True
+
+    async def get(self):
+        self.consuming.set()
+        data = await super().get()
+        _current_update.set(data["update_id"])
+        return data
+
+    def task_done(self):
+        update_id = _current_update.get()
+        if update_id is not None and update_id not in self.latencies:
+            self.latencies[update_id] = time.perf_counter() - self.enqueued[update_id]
+        super().task_done()
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        # Не Linux: хотя бы пиковое значение
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def sample_loop_lag(samples: list[float], interval: float = 0.05):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def start_site(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+def build_images(api_app: web.Application, sb_app: web.Application, api_url: str, count: int,
+                 rng: random.Random) -> list[str]:
+    """Регистрирует в заглушке картинки (большая и маленькая копия) и возвращает их file_id."""
+    file_ids = []
+    for n in range(count):
+        roll = rng.random()
+        if roll < 0.1:
+            # Фото без кода
+            image = Image.frombytes("L", (900, 900), rng.randbytes(900 * 900))
+        else:
+            if roll < 0.3:
+                url = f"{api_url}/redirect/{n}"
+            else:
+                url = f"{api_url}/landing/{n}"
+            if roll > 0.9:
+                sb_app['bad_urls'][url] = "SOCIAL_ENGINEERING"
+            image = Image.open(io.BytesIO(render_qr_png(url, box_size=12))).convert("L")
+
+        file_id = f"img{n}"
+        for suffix, side in (("", 1280), ("-small", 320)):
+            bio = io.BytesIO()
+            image.resize((side, side)).save(bio, "JPEG", quality=85)
+            fake_bot_api.add_file(api_app, file_id + suffix, bio.getvalue())
+        file_ids.append(file_id)
+    return file_ids
+
+
+def make_update(update_id: int, kind: str, user_id: int, file_ids: list[str], rng: random.Random) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(datetime.now().timestamp()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+    }
+    if kind == "photo":
+        file_id = rng.choice(file_ids)
+        message["photo"] = [
+            {"file_id": f"{file_id}-small", "file_unique_id": f"{file_id}-small", "width": 320, "height": 320},
+            {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280},
+        ]
+    elif kind == "qr":
+        # Небольшой набор текстов — часть запросов попадает в кэш file_id
+        message["text"] = f"/qr load test {rng.randrange(200)}"
+    else:
+        message["text"] = "hello"
+    return {"update_id": update_id, "message": message}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in ("photo", "qr", "text"):
+            raise argparse.ArgumentTypeError(f"Unknown update kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def parse_overrides(items: list[str]) -> dict[str, str]:
+    overrides = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {item}")
+        overrides[key] = value
+    return overrides
+
+
+def _percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    if len(values) < 2:
+        return f"{values[0] * 1000:.0f} ms"
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return (f"p50 {q[49] * 1000:.0f} ms, p95 {q[94] * 1000:.0f} ms, "
+            f"p99 {q[98] * 1000:.0f} ms, max {max(values) * 1000:.0f} ms")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    api_app = fake_bot_api.create_app(args.api_latency)
+    sb_app = safebrowsing_stub.create_app({}, args.sb_latency)
+    api_runner, api_url = await start_site(api_app)
+    sb_runner, sb_url = await start_site(sb_app)
+    file_ids = build_images(api_app, sb_app, api_url, args.images, rng)
+
+    stats_dir = tempfile.TemporaryDirectory()
+    settings = Settings(**{
+        "bot_token": "123456:LOADTEST",
+        "telegram_api_url": api_url,
+        "gsb_api_key": "stub",
+        "gsb_api_url": f"{sb_url}/v4",
+        "stats_file_path": os.path.join(stats_dir.name, "stats.txt"),
+        "url_cache_db_path": None,
+        **parse_overrides(args.set),
+    })
+
+    queue = TimedQueue(settings.webhook_queue_size)
+    http_session = create_http_session(settings)
+    bot_task = asyncio.create_task(run_bot(settings, http_session, queue))
+    lag_samples: list[float] = []
+    lag_task = asyncio.create_task(sample_loop_lag(lag_samples))
+
+    # Ждём, пока бот поднимется (пул распознавания прогревается несколько секунд),
+    # чтобы старт не попал в замер
+    await asyncio.wait_for(queue.consuming.wait(), timeout=60)
+    await asyncio.sleep(args.warmup)
+    rss_before = current_rss_mb()
+    lag_samples.clear()
+
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    sent_kinds: dict[int, str] = {}
+    dropped = 0
+    started = time.perf_counter()
+    for update_id in range(1, args.updates + 1):
+        # Держим заданную частоту, не накапливая ошибку
+        delay = started + (update_id - 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        update = make_update(update_id, kind, rng.randrange(1, args.users + 1), file_ids, rng)
+        if queue.put_update(update):
+            sent_kinds[update_id] = kind
+        else:
+            dropped += 1
+
+    try:
+        await asyncio.wait_for(queue.join(), timeout=args.drain_timeout)
+    except asyncio.TimeoutError:
+        print(f"Queue not drained after {args.drain_timeout}s")
+    elapsed = time.perf_counter() - started
+    rss_after = current_rss_mb()
+
+    lag_task.cancel()
+    bot_task.cancel()
+    await asyncio.gather(bot_task, lag_task, return_exceptions=True)
+    await http_session.close()
+    await api_runner.cleanup()
+    await sb_runner.cleanup()
+    stats_dir.cleanup()
+
+    latencies = queue.latencies
+    print(f"Updates: {len(sent_kinds)} accepted, {dropped} dropped (queue full), {len(latencies)} processed")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} updates/s over {elapsed:.1f}s (target {args.rate}/s)")
+    print(f"Latency: {_percentiles(list(latencies.values()))}")
+    for kind in kinds:
+        values = [latency for update_id, latency in latencies.items() if sent_kinds.get(update_id) == kind]
+        print(f"  {kind:<6} {len(values):>6}  {_percentiles(values)}")
+    print(f"Event loop lag: {_percentiles(lag_samples)}")
+    print(f"RSS: {rss_before:.0f} MB -> {rss_after:.0f} MB ({rss_after - rss_before:+.0f} MB)")
+    print("Pipeline stages (mean):")
+    for (stage,), (_, total, count) in STAGE_SECONDS._values.items():
+        print(f"  {stage:<18} {count:>6}  {total / count * 1000:.0f} ms")
+    print(f"Bot API calls: {api_app['stats']}")
+    print(f"Safe Browsing: {sb_app['stats']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=100.0, help="Updates per second")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("photo=0.7,qr=0.2,text=0.1"),
+                        help="Update kinds and weights, e.g. photo=0.7,qr=0.2,text=0.1")
+    parser.add_argument("--users", type=int, default=5000, help="Distinct senders (rate limits are per user)")
+    parser.add_argument("--images", type=int, default=50, help="Distinct photos in the corpus")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Fake Bot API delay per request, seconds")
+    parser.add_argument("--sb-latency", type=float, default=0.05, help="Safe Browsing stub delay, seconds")
+    parser.add_argument("--warmup", type=float, default=0.5, help="Extra seconds to wait after the bot is up")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a Settings field (repeatable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# tools/safebrowsing_stub.py
+"""
+Локальная заглушка Google Safe Browsing v4 для проверки бота без реального API.
+
+Умеет threatMatches:find (Lookup API) и threatListUpdates:fetch +
+fullHashes:find (Update API). Списки строятся из адресов --bad: в них
+попадает 4-байтный префикс хэша канонического выражения host/path.
+
+Запуск:
+    python -m tools.safebrowsing_stub --port 8081 --bad http://evil.test/=MALWARE
+и в окружении бота:
+    GSB_API_URL=http://127.0.0.1:8081/v4 GSB_API_KEY=stub
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import logging
+from aiohttp import web
+from app.services.threat_lists import canonicalize_url, url_expressions
+
+logger = logging.getLogger(__name__)
+
+
+async def threat_matches_find(request: web.Request):
+    stats = request.app['stats']
+    if request.app['latency']:
+        await asyncio.sleep(request.app['latency'])
+
+    body = await request.json()
+    entries = body.get('threatInfo', {}).get('threatEntries', [])
+    stats['requests'] += 1
+    stats['urls'] += len(entries)
+    stats['max_batch'] = max(stats['max_batch'], len(entries))
+    if request.app['fail_status']:
+        return web.json_response({"error": {"code": request.app['fail_status']}}, status=request.app['fail_status'])
+
+    bad_urls = request.app['bad_urls']
+    matches = [
+        {
+            "threatType": bad_urls[entry['url']],
+            "platformType": "ANY_PLATFORM",
+            "threatEntryType": "URL",
+            "threat": {"url": entry['url']},
+            "cacheDuration": "300s",
+        }
+        for entry in entries if entry.get('url') in bad_urls
+    ]
+    return web.json_response({"matches": matches} if matches else {})
+
+
+def _full_hash(url: str) -> bytes:
+    # Самое точное выражение ссылки: host + path (+ query)
+    expression = url_expressions(canonicalize_url(url))[0]
+    return hashlib.sha256(expression.encode("utf-8")).digest()
+
+
+async def threat_list_updates_fetch(request: web.Request):
+    stats = request.app['stats']
+    stats['list_updates'] += 1
+    body = await request.json()
+    state = request.app['list_state']
+
+    responses = []
+    for list_request in body.get('listUpdateRequests', []):
+        threat_type = list_request.get('threatType')
+        prefixes = sorted(
+            _full_hash(url)[:4] for url, threat in request.app['bad_urls'].items() if threat == threat_type
+        )
+        response = {
+            "threatType": threat_type,
+            "platformType": list_request.get('platformType'),
+            "threatEntryType": list_request.get('threatEntryType'),
+            "newClientState": state,
+            "checksum": {"sha256": base64.b64encode(hashlib.sha256(
+                b"corrupt" if request.app['corrupt_checksums'] else b"".join(prefixes)
+            ).digest()).decode()},
+        }
+        if list_request.get('state') == state:
+            response["responseType"] = "PARTIAL_UPDATE"
+        else:
+            response["responseType"] = "FULL_UPDATE"
+            if prefixes:
+                response["additions"] = [{
+                    "compressionType": "RAW",
+                    "rawHashes": {"prefixSize": 4, "rawHashes": base64.b64encode(b"".join(prefixes)).decode()},
+                }]
+        responses.append(response)
+
+    return web.json_response({"listUpdateResponses": responses, "minimumWaitDuration": "60s"})
+
+
+async def full_hashes_find(request: web.Request):
+    stats = request.app['stats']
+    stats['full_hash_requests'] += 1
+    body = await request.json()
+    prefixes = {
+        base64.b64decode(entry['hash'])
+        for entry in body.get('threatInfo', {}).get('threatEntries', [])
+    }
+
+    matches = []
+    for url, threat in request.app['bad_urls'].items():
+        full_hash = _full_hash(url)
+        if any(full_hash.startswith(prefix) for prefix in prefixes):
+            matches.append({
+                "threatType": threat,
+                "platformType": "ANY_PLATFORM",
+                "threatEntryType": "URL",
+                "threat": {"hash": base64.b64encode(full_hash).decode()},
+                "cacheDuration": "300s",
+            })
+    return web.json_response({"matches": matches, "negativeCacheDuration": "300s"})
+
+
+async def get_stats(request: web.Request):
+    return web.json_response(request.app['stats'])
+
+
+def create_app(bad_urls: dict[str, str] | None = None, latency: float = 0.0,
+               fail_status: int | None = None) -> web.Application:
+    """
+    bad_urls: адрес -> threatType, который вернёт заглушка.
+    fail_status: если задан, threatMatches:find отвечает этим HTTP-статусом (проверка ошибок API).
+    app['corrupt_checksums'] = True портит контрольные суммы списков (проверка сброса).
+    """
+    app = web.Application()
+    app['bad_urls'] = dict(bad_urls or {})
+    app['latency'] = latency
+    app['fail_status'] = fail_status
+    app['corrupt_checksums'] = False
+    app['list_state'] = "c3R1Yg=="
+    app['stats'] = {"requests": 0, "urls": 0, "max_batch": 0, "list_updates": 0, "full_hash_requests": 0}
+    app.router.add_post("/v4/threatMatches:find", threat_matches_find)
+    app.router.add_post("/v4/threatListUpdates:fetch", threat_list_updates_fetch)
+    app.router.add_post("/v4/fullHashes:find", full_hashes_find)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Safe Browsing v4 stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Artificial delay per request, seconds")
+    parser.add_argument("--fail-status", type=int, default=None, help="Answer threatMatches:find with this status")
+    parser.add_argument("--bad", action="append", default=[], metavar="URL=THREAT",
+                        help="URL reported as unsafe (repeatable)")
+    args = parser.parse_args()
+
+    bad_urls = {}
+    for item in args.bad:
+        url, _, threat = item.partition("=")
+        bad_urls[url] = threat or "MALWARE"
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(bad_urls, args.latency, args.fail_status), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()